@@ -0,0 +1,66 @@
+'''Compare the chunking engine with langchain's RecursiveCharacterTextSplitter on large texts.
+
+Run from the backend directory:
+
+    python -m benchmarks.chunking [text_file ...] [--chunk-size 500] [--chunk-overlap 0]
+
+A synthetic document of paragraphs and lines is generated when no file is given.
+The splitter is built once per document, like the ingestion used to do, the engine reuses its cached chunker.
+'''
+import argparse
+import random
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from utils.chunking import get_chunker, get_encoding
+
+WORDS = "quivr brain vector embedding document chunk answer question upload crawl summary model".split()
+
+
+def generate_text(paragraphs=3000):
+    random.seed(0)
+    return "\n\n".join(
+        "\n".join(" ".join(random.choices(WORDS, k=random.randint(5, 30))) + "." for _ in range(random.randint(1, 8)))
+        for _ in range(paragraphs))
+
+
+def split_with_langchain(text, chunk_size, chunk_overlap):
+    splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return splitter.split_text(text)
+
+
+def split_with_engine(text, chunk_size, chunk_overlap):
+    return get_chunker(chunk_size, chunk_overlap).split_text(text)
+
+
+def measure(split, texts, chunk_size, chunk_overlap):
+    started_at = time.perf_counter()
+    chunks = [chunk for text in texts for chunk in split(text, chunk_size, chunk_overlap)]
+    return time.perf_counter() - started_at, chunks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--chunk-overlap", type=int, default=0)
+    args = parser.parse_args()
+
+    texts = []
+    for file_path in args.files:
+        with open(file_path, encoding="utf-8", errors="replace") as text_file:
+            texts.append(text_file.read())
+    texts = texts or [generate_text()]
+    corpus_mb = sum(len(text.encode("utf-8")) for text in texts) / 1024 / 1024
+    encoding = get_encoding()
+    print(f"{len(texts)} documents, {corpus_mb:.1f} MB, chunk size {args.chunk_size}, overlap {args.chunk_overlap}")
+
+    for name, split in (("langchain", split_with_langchain), ("engine", split_with_engine)):
+        elapsed, chunks = measure(split, texts, args.chunk_size, args.chunk_overlap)
+        sizes = [len(encoding.encode_ordinary(chunk)) for chunk in chunks]
+        print(f"{name:>10}: {elapsed:.2f}s, {corpus_mb / elapsed:.2f} MB/s, {len(chunks)} chunks, "
+              f"{sum(sizes) / len(sizes):.0f} tokens on average, {max(sizes)} at most")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+'''Compare the HTML loaders on throughput and peak memory.
+
+Run from the backend directory:
+
+    python -m benchmarks.html_loaders [corpus_dir]
+
+Every *.html file of corpus_dir is loaded, a synthetic corpus of crawled-like pages is generated when it's omitted.
+Each loader runs in a fresh process so its import cost and peak RSS are measured in isolation.
+'''
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from glob import glob
+
+LOADERS = {
+    "fast": ("parsers.html_text", "FastHTMLLoader"),
+    "unstructured": ("langchain.document_loaders", "UnstructuredHTMLLoader"),
+}
+
+WORDS = "quivr brain vector embedding document chunk answer question upload crawl summary model".split()
+
+
+def generate_corpus(directory, pages=200, paragraphs=60):
+    random.seed(0)
+    for index in range(pages):
+        body = "".join(
+            f"<p>{' '.join(random.choices(WORDS, k=40))} <a href='/page/{i}'>link</a></p>"
+            for i in range(paragraphs))
+        table = "".join(f"<tr><td>{i}</td><td>{random.choice(WORDS)}</td></tr>" for i in range(20))
+        with open(os.path.join(directory, f"page-{index}.html"), "w") as page:
+            page.write(
+                "<html><head><title>Page</title><style>body{margin:0}</style>"
+                "<script>window.analytics=[];</script></head><body>"
+                "<nav><ul><li><a href='/'>Home</a></li><li><a href='/docs'>Docs</a></li></ul></nav>"
+                f"<main><h1>Page {index}</h1>{body}<table>{table}</table></main>"
+                "<footer>Copyright, legal notice and cookie banner</footer></body></html>")
+
+
+def run_loader(name, files, results):
+    started_at = time.perf_counter()
+    module_name, class_name = LOADERS[name]
+    loader_class = getattr(__import__(module_name, fromlist=[class_name]), class_name)
+    imported_at = time.perf_counter()
+    characters = 0
+    for file_path in files:
+        characters += sum(len(doc.page_content) for doc in loader_class(file_path).load())
+    finished_at = time.perf_counter()
+    results[name] = {
+        "import_s": imported_at - started_at,
+        "load_s": finished_at - imported_at,
+        "characters": characters,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    corpus_dir = sys.argv[1] if len(sys.argv) > 1 else tempfile.mkdtemp()
+    files = sorted(glob(os.path.join(corpus_dir, "*.html")))
+    if not files:
+        generate_corpus(corpus_dir)
+        files = sorted(glob(os.path.join(corpus_dir, "*.html")))
+    corpus_mb = sum(os.path.getsize(file_path) for file_path in files) / 1024 / 1024
+    print(f"{len(files)} pages, {corpus_mb:.1f} MB")
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Manager().dict()
+    for name in LOADERS:
+        process = context.Process(target=run_loader, args=(name, files, results))
+        process.start()
+        process.join()
+        if name not in results:
+            print(f"{name:>12}: failed, is it installed?")
+            continue
+        result = results[name]
+        print(f"{name:>12}: import {result['import_s']:.2f}s, {len(files) / result['load_s']:.1f} pages/s, "
+              f"{corpus_mb / result['load_s']:.2f} MB/s, peak RSS {result['peak_rss_mb']:.0f} MB, "
+              f"{result['characters']} characters extracted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+'''Compare inserting vectors through PostgREST with binary COPY over a direct Postgres connection.
+
+Run from the backend directory, with SUPABASE_URL and SUPABASE_SERVICE_KEY for the REST path
+and DATABASE_URL for the COPY path, a local Postgres with pgvector and the vectors table of
+scripts/supabase_vector_store_document.sql is enough for the latter:
+
+    python -m benchmarks.vector_store [--rows 2000] [--batch-size 100]
+
+Random embeddings are inserted under a benchmark user_id whose rows are deleted afterwards.
+'''
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+
+from utils import postgres
+
+DIMENSIONS = 1536
+
+
+def generate_rows(user_id, count):
+    random.seed(0)
+    return [
+        (user_id, f"Benchmark chunk {index} " * 20, {"file_name": "benchmark.txt", "chunk": index},
+         [random.uniform(-1, 1) for _ in range(DIMENSIONS)])
+        for index in range(count)
+    ]
+
+
+def insert_with_rest(rows, batch_size):
+    from supabase import create_client
+    client = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_KEY"])
+    started_at = time.perf_counter()
+    for start in range(0, len(rows), batch_size):
+        client.table("vectors").insert([
+            {"user_id": user_id, "content": content, "metadata": metadata, "embedding": embedding}
+            for user_id, content, metadata, embedding in rows[start:start + batch_size]
+        ]).execute()
+    elapsed = time.perf_counter() - started_at
+    client.table("vectors").delete().eq("user_id", rows[0][0]).execute()
+    return elapsed
+
+
+async def insert_with_copy(rows, batch_size):
+    started_at = time.perf_counter()
+    for start in range(0, len(rows), batch_size):
+        await postgres.copy_vectors(rows[start:start + batch_size])
+    elapsed = time.perf_counter() - started_at
+    await postgres.delete_user_vectors(rows[0][0])
+    await postgres.close_pool()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    rows = generate_rows(f"benchmark-{uuid.uuid4()}", args.rows)
+    print(f"{args.rows} vectors of {DIMENSIONS} dimensions in batches of {args.batch_size}")
+    if os.environ.get("SUPABASE_URL"):
+        elapsed = insert_with_rest(rows, args.batch_size)
+        print(f"{'rest':>6}: {elapsed:.2f}s, {args.rows / elapsed:.0f} vectors/s")
+    else:
+        print(f"{'rest':>6}: skipped, SUPABASE_URL is not set")
+    if postgres.direct_postgres:
+        elapsed = asyncio.run(insert_with_copy(rows, args.batch_size))
+        print(f"{'copy':>6}: {elapsed:.2f}s, {args.rows / elapsed:.0f} vectors/s")
+    else:
+        print(f"{'copy':>6}: skipped, DATABASE_URL is not set")
+
+
+if __name__ == "__main__":
+    main()
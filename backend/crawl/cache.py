@@ -0,0 +1,62 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+crawl_cache_path = os.environ.get("CRAWL_CACHE_PATH", "crawl_cache.sqlite3")
+
+
+class CrawlRecord(BaseModel):
+    url: str
+    file_name: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_sha1: str
+    # Links of the page, so the crawl can go on below a page answered with 304 Not Modified
+    links: List[str] = []
+
+
+class CrawlCache:
+    '''Persistent per user and url record of the validators and content hash of the last ingested version of a page.'''
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "user_id TEXT, url TEXT, file_name TEXT, etag TEXT, last_modified TEXT, content_sha1 TEXT, "
+            "links TEXT, crawled_at REAL, PRIMARY KEY (user_id, url))")
+        self._connection.commit()
+
+    def get(self, user_id: str, url: str) -> Optional[CrawlRecord]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT url, file_name, etag, last_modified, content_sha1, links FROM pages "
+                "WHERE user_id = ? AND url = ?", (user_id, url)).fetchone()
+        if row is None:
+            return None
+        url, file_name, etag, last_modified, content_sha1, links = row
+        return CrawlRecord(url=url, file_name=file_name, etag=etag, last_modified=last_modified,
+                           content_sha1=content_sha1, links=json.loads(links))
+
+    def set(self, user_id: str, record: CrawlRecord):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, record.url, record.file_name, record.etag, record.last_modified,
+                 record.content_sha1, json.dumps(record.links), time.time()))
+            self._connection.commit()
+
+    def forget(self, user_id: str, file_name: str):
+        '''Drop the record of a page whose vectors were deleted, so the next crawl ingests it again.'''
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM pages WHERE user_id = ? AND file_name = ?", (user_id, file_name))
+            self._connection.commit()
+
+
+crawl_cache = CrawlCache(crawl_cache_path)
@@ -1,43 +1,179 @@
-import requests
-from pydantic import BaseModel
-import requests
+import asyncio
+import os
 import re
+import time
 import unicodedata
-import tempfile
-import os
+from collections import defaultdict
+from html.parser import HTMLParser
+from typing import AsyncIterator, List, Optional
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import httpx
+from logger import get_logger
+from pydantic import BaseModel
+from utils.file import compute_sha1_from_content
+
+from .cache import CrawlCache, CrawlRecord
+
+logger = get_logger(__name__)
+
+crawl_host_concurrency = int(os.environ.get("CRAWL_HOST_CONCURRENCY", 4))
+crawl_max_connections = int(os.environ.get("CRAWL_MAX_CONNECTIONS", 50))
+crawl_request_timeout = float(os.environ.get("CRAWL_REQUEST_TIMEOUT", 10))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    '''The pooled HTTP client shared by every crawl of the process.'''
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=crawl_request_timeout,
+            limits=httpx.Limits(max_connections=crawl_max_connections),
+            headers={"User-Agent": "QuivrCrawler/1.0"},
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+class CrawledPage(BaseModel):
+    url: str
+    # Where the redirects of url led, its links are relative to it
+    final_url: str
+    # None when the server answered 304 Not Modified
+    html: Optional[str]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_sha1: str
+    links: List[str]
+    # False when the page is the same as the last time it was ingested
+    changed: bool = True
+
+    @property
+    def file_name(self):
+        return slugify(self.url) + ".html"
+
+    def to_record(self) -> CrawlRecord:
+        return CrawlRecord(url=self.url, file_name=self.file_name, etag=self.etag, last_modified=self.last_modified,
+                           content_sha1=self.content_sha1, links=self.links)
 
 
 class CrawlWebsite(BaseModel):
     url : str
     js : bool = False
+    # Number of levels fetched breadth first, 1 only fetches url itself
     depth : int = 1
     max_pages : int = 100
     max_time : int = 60
 
-    def _crawl(self, url):
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.text
-        else:
-            return None
+    async def crawl(self, client: Optional[httpx.AsyncClient] = None, cache: Optional[CrawlCache] = None,
+                    user_id: str = "none") -> AsyncIterator[CrawledPage]:
+        '''Crawl breadth first from url, staying on its host or the host it redirects to, and yield the pages as
+        they arrive.
+        With a cache, pages are requested conditionally and the ones that didn't change are flagged as such.'''
+        if self.js:
+            logger.warning("JavaScript rendering is not supported, crawling the raw HTML")
+        client = client or get_client()
+        deadline = time.monotonic() + self.max_time
+        host_semaphores = defaultdict(lambda: asyncio.Semaphore(crawl_host_concurrency))
+        start_url = urldefrag(self.url)[0]
+        seen = {start_url}
+        hosts = {urlparse(start_url).netloc}
+        level = [start_url]
+        fetched = 0
 
-    def process(self):
-        content = self._crawl(self.url)
-        ## Create a file
-        file_name = slugify(self.url) + ".html"
-        temp_file_path = os.path.join(tempfile.gettempdir(), file_name)
-        with open(temp_file_path, 'w') as temp_file:
-            temp_file.write(content)
-            ## Process the file
-        
-        if content:
-            return temp_file_path, file_name
-        else:
+        for current_depth in range(self.depth):
+            if not level:
+                return
+            tasks = [
+                asyncio.create_task(self._fetch(
+                    client, url, host_semaphores[urlparse(url).netloc], cache and cache.get(user_id, url)))
+                for url in level[:self.max_pages - fetched]
+            ]
+            next_level = []
+            try:
+                for next_page in asyncio.as_completed(tasks, timeout=max(0, deadline - time.monotonic())):
+                    page = await next_page
+                    if page is None:
+                        continue
+                    fetched += 1
+                    if page.url == start_url:
+                        # A site moved to another host (http to https, a www. prefix) is crawled on its new host
+                        hosts.add(urlparse(page.final_url).netloc)
+                        seen.add(page.final_url)
+                    yield page
+                    if fetched >= self.max_pages:
+                        return
+                    if current_depth + 1 < self.depth:
+                        for link in page.links:
+                            if link not in seen and urlparse(link).netloc in hosts:
+                                seen.add(link)
+                                next_level.append(link)
+            except asyncio.TimeoutError:
+                logger.info(f"Crawl of {self.url} stopped after {self.max_time}s and {fetched} pages")
+                return
+            finally:
+                for task in tasks:
+                    task.cancel()
+            level = next_level
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str, semaphore: asyncio.Semaphore,
+                     record: Optional[CrawlRecord]) -> Optional[CrawledPage]:
+        headers = {}
+        if record and record.etag:
+            headers["If-None-Match"] = record.etag
+        if record and record.last_modified:
+            headers["If-Modified-Since"] = record.last_modified
+        async with semaphore:
+            try:
+                response = await client.get(url, headers=headers)
+            except httpx.HTTPError as e:
+                logger.warning(f"Could not fetch {url}: {e}")
+                return None
+        if response.status_code == 304 and record:
+            return CrawledPage(url=url, final_url=str(response.url), html=None, etag=record.etag,
+                               last_modified=record.last_modified, content_sha1=record.content_sha1,
+                               links=record.links, changed=False)
+        if response.status_code != 200 or "html" not in response.headers.get("content-type", "text/html"):
             return None
+        html = response.text
+        content_sha1 = compute_sha1_from_content(response.content)
+        return CrawledPage(
+            url=url, final_url=str(response.url), html=html, etag=response.headers.get("etag"),
+            last_modified=response.headers.get("last-modified"), content_sha1=content_sha1, links=extract_links(str(response.url), html),
+            changed=not record or record.content_sha1 != content_sha1)
+
+
+class _LinkParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.links: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(href)
+
+
+def extract_links(base_url: str, html: str) -> List[str]:
+    '''Absolute http(s) links of the page, without fragments.'''
+    parser = _LinkParser()
+    parser.feed(html)
+    links = (urldefrag(urljoin(base_url, href))[0] for href in parser.links)
+    return [link for link in links if urlparse(link).scheme in ("http", "https")]
 
 
 def slugify(text):
     text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('utf-8')
     text = re.sub(r'[^\w\s-]', '', text).strip().lower()
     text = re.sub(r'[-\s]+', '-', text)
-    return text
\ No newline at end of file
+    return text
@@ -1,23 +1,50 @@
+import asyncio
 import os
-from typing import Any, List
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple
 
+from langchain.callbacks.streaming_aiter import AsyncIteratorCallbackHandler
 from langchain.chains import ConversationalRetrievalChain
-from langchain.chat_models import ChatOpenAI, ChatVertexAI
-from langchain.chat_models.anthropic import ChatAnthropic
 from langchain.docstore.document import Document
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.llms import VertexAI
+from langchain.embeddings.base import Embeddings
 from langchain.memory import ConversationBufferMemory
 from langchain.vectorstores import SupabaseVectorStore
-from llm import LANGUAGE_PROMPT
+from llm.registry import get_qa_chains, supports_async
 from models.chats import ChatMessage
-from supabase import Client, create_client
+from supabase import Client
+from utils.database import rpc
+from utils.vectors import embed_question, embeddings, supabase_client
+
+# Threads running the blocking calls of the chats: models without async generation and summaries evaluation
+chat_executor_workers = int(os.environ.get("CHAT_EXECUTOR_WORKERS", 16))
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=chat_executor_workers, thread_name_prefix="chat")
+    return _executor
+
+
+def shutdown_chat_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def run_blocking(func: Callable, *args, **kwargs):
+    '''Run a blocking call of a chat in the bounded executor, so a burst of chats can't exhaust the default one.'''
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), partial(func, *args, **kwargs))
 
 
 class CustomSupabaseVectorStore(SupabaseVectorStore):
     '''A custom vector store that uses the match_vectors table instead of the vectors table.'''
     user_id: str
-    def __init__(self, client: Client, embedding: OpenAIEmbeddings, table_name: str, user_id: str = "none"):
+    def __init__(self, client: Client, embedding: Embeddings, table_name: str, user_id: str = "none"):
         super().__init__(client, embedding, table_name)
         self.user_id = user_id
     
@@ -30,8 +57,7 @@ class CustomSupabaseVectorStore(SupabaseVectorStore):
         threshold: float = 0.5, 
         **kwargs: Any
     ) -> List[Document]:
-        vectors = self._embedding.embed_documents([query])
-        query_embedding = vectors[0]
+        query_embedding = embed_question(query)
         res = self._client.rpc(
             table,
             {
@@ -40,7 +66,31 @@ class CustomSupabaseVectorStore(SupabaseVectorStore):
                 "p_user_id": self.user_id,
             },
         ).execute()
+        return self._to_documents(res.data)
+
+    async def asimilarity_search(
+        self,
+        query: str,
+        user_id: str = "none",
+        table: str = "match_vectors",
+        k: int = 4,
+        threshold: float = 0.5,
+        **kwargs: Any
+    ) -> List[Document]:
+        '''Same search through the pooled async client, used by the async retriever.'''
+        query_embedding = await asyncio.to_thread(embed_question, query)
+        res = await rpc(
+            table,
+            {
+                "query_embedding": query_embedding,
+                "match_count": k,
+                "p_user_id": self.user_id,
+            },
+        )
+        return self._to_documents(res.data)
 
+    @staticmethod
+    def _to_documents(data) -> List[Document]:
         match_result = [
             (
                 Document(
@@ -49,7 +99,7 @@ class CustomSupabaseVectorStore(SupabaseVectorStore):
                 ),
                 search.get("similarity", 0.0),
             )
-            for search in res.data
+            for search in data
             if search.get("content")
         ]
 
@@ -57,49 +107,58 @@ class CustomSupabaseVectorStore(SupabaseVectorStore):
 
         return documents
 
-def get_environment_variables():
-    '''Get the environment variables.'''
-    openai_api_key = os.getenv("OPENAI_API_KEY")
-    anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
-    supabase_url = os.getenv("SUPABASE_URL")
-    supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
-    
-    return openai_api_key, anthropic_api_key, supabase_url, supabase_key
-
-def create_clients_and_embeddings(openai_api_key, supabase_url, supabase_key):
-    '''Create the clients and embeddings.'''
-    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
-    supabase_client = create_client(supabase_url, supabase_key)
-    
-    return supabase_client, embeddings
+def get_qa_llm(chat_message: ChatMessage, user_id: str, streaming: bool = False):
+    '''Get the question answering chain of a request: a view over the shared models and chains of the registry
+    with the memory and the retriever of the user.'''
+    chains = get_qa_chains(chat_message.model, chat_message.temperature, chat_message.max_tokens, streaming)
+    if chains is None:
+        return None
+    question_generator, combine_docs_chain = chains
 
-def get_qa_llm(chat_message: ChatMessage, user_id: str):
-    '''Get the question answering language model.'''
-    openai_api_key, anthropic_api_key, supabase_url, supabase_key = get_environment_variables()
-    supabase_client, embeddings = create_clients_and_embeddings(openai_api_key, supabase_url, supabase_key)
-    
     vector_store = CustomSupabaseVectorStore(
         supabase_client, embeddings, table_name="vectors", user_id=user_id)
     memory = ConversationBufferMemory(
         memory_key="chat_history", return_messages=True)
-    
-    ConversationalRetrievalChain.prompts = LANGUAGE_PROMPT
-    
-    qa = None
-    # this overwrites the built-in prompt of the ConversationalRetrievalChain
-    ConversationalRetrievalChain.prompts = LANGUAGE_PROMPT
-    if chat_message.model.startswith("gpt"):
-        qa = ConversationalRetrievalChain.from_llm(
-            ChatOpenAI(
-                model_name=chat_message.model, openai_api_key=openai_api_key, 
-                temperature=chat_message.temperature, max_tokens=chat_message.max_tokens), 
-                vector_store.as_retriever(), memory=memory, verbose=True, 
-                max_tokens_limit=1024)
-    elif chat_message.model.startswith("vertex"):
-        qa = ConversationalRetrievalChain.from_llm(
-            ChatVertexAI(), vector_store.as_retriever(), memory=memory, verbose=False, max_tokens_limit=1024)
-    elif anthropic_api_key and chat_message.model.startswith("claude"):
-        qa = ConversationalRetrievalChain.from_llm(
-            ChatAnthropic(
-                model=chat_message.model, anthropic_api_key=anthropic_api_key, temperature=chat_message.temperature, max_tokens_to_sample=chat_message.max_tokens), vector_store.as_retriever(), memory=memory, verbose=False, max_tokens_limit=102400)
-    return qa
+
+    return ConversationalRetrievalChain(
+        retriever=vector_store.as_retriever(), question_generator=question_generator,
+        combine_docs_chain=combine_docs_chain, memory=memory, verbose=chat_message.model.startswith("gpt"),
+        max_tokens_limit=102400 if chat_message.model.startswith("claude") else 1024)
+
+
+async def acall_qa(qa: ConversationalRetrievalChain, model: str, question: str) -> str:
+    '''Answer the question with the async chain, in the chat executor for the models without async generation.'''
+    if supports_async(model):
+        response = await qa.acall({"question": question})
+    else:
+        response = await run_blocking(qa, {"question": question})
+    return response["answer"]
+
+
+async def stream_answer(qa: ConversationalRetrievalChain, model: str, question: str) -> AsyncIterator[Tuple[str, Any]]:
+    '''Answer the question with a streaming chain of get_qa_llm, yielding ("sources", documents) once they are
+    retrieved, then ("token", text) as the model generates the answer and finally ("answer", answer).'''
+    # Same retrieval as the chain, documents trimmed to its max_tokens_limit
+    documents = await qa._aget_docs(question, {})
+    yield "sources", documents
+
+    handler = AsyncIteratorCallbackHandler()
+    if supports_async(model):
+        task = asyncio.create_task(
+            qa.combine_docs_chain.arun(input_documents=documents, question=question, callbacks=[handler]))
+    else:
+        task = asyncio.ensure_future(
+            run_blocking(qa.combine_docs_chain.run, input_documents=documents, question=question))
+    # The handler only stops on the end or the error of the model, not when the chain fails before calling it
+    task.add_done_callback(lambda _: handler.done.set())
+    streamed = False
+    try:
+        async for token in handler.aiter():
+            streamed = True
+            yield "token", token
+        answer = await task
+    finally:
+        task.cancel()
+    if not streamed:
+        yield "token", answer
+    yield "answer", answer
@@ -0,0 +1,53 @@
+import os
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from langchain.chains import LLMChain
+from langchain.chains.combine_documents.base import BaseCombineDocumentsChain
+from langchain.chains.question_answering import load_qa_chain
+from langchain.chat_models import ChatOpenAI, ChatVertexAI
+from langchain.chat_models.anthropic import ChatAnthropic
+from langchain.chat_models.base import BaseChatModel
+from llm.LANGUAGE_PROMPT import CONDENSE_QUESTION_PROMPT, QA_PROMPT
+
+# Models and chains hold no per-request state, they are built once per process for each model and settings
+# and shared by every request using them. Memory and retriever stay per request, see llm/qa.py.
+# Streaming models report their tokens to the callbacks given with each call, so they are shared as well.
+
+openai_api_key = os.getenv("OPENAI_API_KEY")
+anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
+
+
+@lru_cache(maxsize=64)
+def get_chat_model(model: str, temperature: float, max_tokens: int, streaming: bool = False) -> Optional[BaseChatModel]:
+    if model.startswith("gpt"):
+        return ChatOpenAI(
+            model_name=model, openai_api_key=openai_api_key, temperature=temperature, max_tokens=max_tokens,
+            streaming=streaming)
+    if model.startswith("vertex"):
+        # Vertex doesn't stream, its answer comes in one piece
+        return ChatVertexAI()
+    if anthropic_api_key and model.startswith("claude"):
+        return ChatAnthropic(
+            model=model, anthropic_api_key=anthropic_api_key, temperature=temperature, max_tokens_to_sample=max_tokens,
+            streaming=streaming)
+    return None
+
+
+def supports_async(model: str) -> bool:
+    '''Vertex chat models of this langchain release have no async generation, they are run in threads.'''
+    return not model.startswith("vertex")
+
+
+@lru_cache(maxsize=64)
+def get_qa_chains(model: str, temperature: float, max_tokens: int,
+                  streaming: bool = False) -> Optional[Tuple[LLMChain, BaseCombineDocumentsChain]]:
+    '''The question generator and the documents chain of the model, with the prompts answering in the language
+    of the question. Only the documents chain streams, the condensed question is never shown.'''
+    llm = get_chat_model(model, temperature, max_tokens)
+    if llm is None:
+        return None
+    question_generator = LLMChain(llm=llm, prompt=CONDENSE_QUESTION_PROMPT)
+    combine_docs_chain = load_qa_chain(
+        get_chat_model(model, temperature, max_tokens, streaming), chain_type="stuff", prompt=QA_PROMPT)
+    return question_generator, combine_docs_chain
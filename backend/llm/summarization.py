@@ -1,49 +1,41 @@
+import asyncio
 import os
+import random
+from functools import lru_cache
+from typing import Callable, Optional
 
 import guidance
 import openai
 
 from logger import get_logger
+from utils.completion_cache import completion_cache, completion_key
 
 logger = get_logger(__name__)
 
 openai_api_key = os.environ.get("OPENAI_API_KEY")
 openai.api_key = openai_api_key
-summary_llm = guidance.llms.OpenAI('gpt-3.5-turbo', caching=False)
+summary_model = 'gpt-3.5-turbo'
+# Summarization calls in flight across all the ingestion jobs of the process
+summarization_concurrency = int(os.environ.get("SUMMARIZATION_CONCURRENCY", 8))
+summarization_max_retries = int(os.environ.get("SUMMARIZATION_MAX_RETRIES", 5))
 
+_semaphore: Optional[asyncio.Semaphore] = None
 
-def llm_summerize(document):
-    summary = guidance("""
-{{#system~}}
-You are a world best summarizer. \n
-Condense the text, capturing essential points and core ideas. Include relevant \
-examples, omit excess details, and ensure the summary's length matches the \
-original's complexity.
-{{/system~}}
-{{#user~}}
-Summarize the following text:
+# Summaries call the API directly rather than through guidance, which retries rate limited calls on its own with a
+# fixed sleep and a cap of calls per minute, so the errors reach the backoff of summarize_with_backoff
+SUMMARY_SYSTEM_PROMPT = (
+    "You are a world best summarizer. \n"
+    "Condense the text, capturing essential points and core ideas. Include relevant "
+    "examples, omit excess details, and ensure the summary's length matches the "
+    "original's complexity.")
+SUMMARY_USER_PROMPT = """Summarize the following text:
 ---
-{{document}}
-{{/user~}}
+{document}"""
+summary_temperature = 0.2
+summary_max_tokens = 100
 
-{{#assistant~}}
-{{gen 'summarization' temperature=0.2 max_tokens=100}}
-{{/assistant~}}
-""", llm=summary_llm)
-
-    summary = summary(document=document)
-    logger.info('Summarization: %s', summary)
-    return summary['summarization']
-
-
-def llm_evaluate_summaries(question, summaries, model):
-    if not model.startswith('gpt'):
-        logger.info(
-            f'Model {model} not supported. Using gpt-3.5-turbo instead.')
-        model = 'gpt-3.5-turbo'
-    logger.info(f'Evaluating summaries with {model}')
-    evaluation_llm = guidance.llms.OpenAI(model, caching=False)
-    evaluation = guidance("""
+# Completions are cached by prompt, the sampling parameters are part of the templates
+EVALUATION_PROMPT = """
 {{#system~}}
 You are a world best evaluator. You evaluate the relevance of summaries based \
 on user input question. Return evaluation in following csv format, csv headers \
@@ -74,10 +66,71 @@ Summary
 {{#assistant~}}
 {{gen 'evaluation' temperature=0.2 stop='<|im_end|>'}}
 {{/assistant~}}
-""", llm=evaluation_llm)
-    result = evaluation(question=question, summaries=summaries)
+"""
+
+
+def llm_summerize(document):
+    key = completion_key(SUMMARY_SYSTEM_PROMPT + SUMMARY_USER_PROMPT, document=document,
+                         temperature=summary_temperature, max_tokens=summary_max_tokens)
+    cached = completion_cache.get(summary_model, key)
+    if cached is not None:
+        return cached
+    response = openai.ChatCompletion.create(
+        model=summary_model,
+        messages=[
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": SUMMARY_USER_PROMPT.format(document=document)},
+        ],
+        temperature=summary_temperature,
+        max_tokens=summary_max_tokens,
+    )
+    summary = response["choices"][0]["message"]["content"]
+    logger.info('Summarization: %s', summary)
+    completion_cache.set(summary_model, key, summary)
+    return summary
+
+
+async def summarize_with_backoff(document, summarize: Callable[[str], str] = llm_summerize) -> str:
+    '''Run the blocking `summarize` in a thread within the concurrency limit, backing off exponentially with jitter
+    when the API is rate limited. The slot is held while backing off, so every call slows down together.'''
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(summarization_concurrency)
+    async with _semaphore:
+        for attempt in range(summarization_max_retries + 1):
+            try:
+                return await asyncio.to_thread(summarize, document)
+            except openai.error.RateLimitError:
+                if attempt == summarization_max_retries:
+                    raise
+                delay = min(60, 2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f"Summarization rate limited, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+
+@lru_cache(maxsize=None)
+def get_evaluation_llm(model):
+    '''Build the evaluation LLM of a model once, it loads the tokenizer of the model.'''
+    return guidance.llms.OpenAI(model, caching=False)
+
+
+def llm_evaluate_summaries(question, summaries, model):
+    if not model.startswith('gpt'):
+        logger.info(
+            f'Model {model} not supported. Using gpt-3.5-turbo instead.')
+        model = 'gpt-3.5-turbo'
+    logger.info(f'Evaluating summaries with {model}')
+    # Only the fields of the summaries used by the prompt make the key
+    key = completion_key(EVALUATION_PROMPT, question=question, summaries=[
+        (summary['id'], summary['document_id'], summary['content'], (summary['metadata'] or {}).get('file_name'))
+        for summary in summaries])
+    result = completion_cache.get(model, key)
+    if result is None:
+        evaluation = guidance(EVALUATION_PROMPT, llm=get_evaluation_llm(model))
+        result = evaluation(question=question, summaries=summaries)['evaluation']
+        completion_cache.set(model, key, result)
     evaluations = {}
-    for evaluation in result['evaluation'].split('\n'):
+    for evaluation in result.split('\n'):
         if evaluation == '' or not evaluation[0].isdigit():
             continue
         logger.info('Evaluation Row: %s', evaluation)
@@ -1,29 +1,47 @@
+import asyncio
+import json
 import os
-import shutil
 import time
-from tempfile import SpooledTemporaryFile
 
 import pypandoc
 from auth.auth_bearer import JWTBearer
-from crawl.crawler import CrawlWebsite
-from fastapi import Depends, FastAPI, UploadFile
-from llm.qa import get_qa_llm
+from crawl.cache import crawl_cache
+from crawl.crawler import CrawlWebsite, close_client
+from fastapi import Depends, FastAPI, HTTPException, Request, UploadFile
+from fastapi.responses import StreamingResponse
+from llm.qa import (acall_qa, get_qa_llm, run_blocking, shutdown_chat_executor,
+                    stream_answer)
 from llm.summarization import llm_evaluate_summaries
 from logger import get_logger
 from middlewares.cors import add_cors_middleware
 from models.chats import ChatMessage
+from models.ingestion import IngestionOptions
 from models.users import User
+from parsers.executor import shutdown_executor
 from pydantic import BaseModel
-from supabase import Client
-from utils.file import convert_bytes, get_file_size
-from utils.processors import filter_file
-from utils.vectors import (CommonsDep, create_user, similarity_search,
-                           update_user_request_count)
+from utils.answer_cache import answer_cache
+from utils.completion_cache import completion_cache
+from utils.database import close_database, execute
+from utils.embedding_cache import embedding_cache, query_embedding_cache
+from utils.file import convert_bytes, spool_upload
+from utils.jobs import (IngestionQueueFull, enqueue_job, get_job,
+                        get_pending_jobs, start_workers, stop_workers)
+from utils.postgres import close_pool
+from utils.processors import filter_crawl, filter_file
+from utils.vectors import (CommonsDep, adelete_orphan_chunks, create_user,
+                           embed_question, similarity_search,
+                           update_user_request_count, vectors_content_table,
+                           vectors_table)
 
 logger = get_logger(__name__)
 
 app = FastAPI()
 
+# Seconds a chat answer can take before the request fails with a 504
+chat_timeout = float(os.environ.get("CHAT_TIMEOUT", 120))
+# Seconds between two checks that the client of a chat is still connected
+disconnect_poll_interval = 1
+
 
 add_cors_middleware(app)
 
@@ -32,109 +50,262 @@ add_cors_middleware(app)
 @app.on_event("startup")
 async def startup_event():
     pypandoc.download_pandoc()
+    start_workers()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_workers()
+    shutdown_executor()
+    shutdown_chat_executor()
+    await close_client()
+    await close_database()
+    await close_pool()
+
+
+def enqueue_ingestion(user: User, name: str, work, size: int = 0):
+    async def ingest_and_invalidate():
+        try:
+            return await work()
+        finally:
+            # The vectors of the user changed, their cached answers may be outdated
+            answer_cache.invalidate(user.email)
+
+    try:
+        job = enqueue_job(user.email, name, ingest_and_invalidate, size)
+    except IngestionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"message": f"⏳ {name} is being processed.", "type": "success", "job_id": job.id}
+
+
+def ingestion_options(options: IngestionOptions = Depends()) -> IngestionOptions:
+    if options.chunk_size < 1 or not 0 <= options.chunk_overlap < options.chunk_size:
+        raise HTTPException(status_code=422, detail="chunk_overlap must be between 0 and chunk_size, excluded.")
+    if options.csv_block_tokens < 0:
+        raise HTTPException(status_code=422, detail="csv_block_tokens must be positive, or 0 to embed rows one by one.")
+    return options
 
 
 
 
 @app.post("/upload", dependencies=[Depends(JWTBearer())])
-async def upload_file(commons: CommonsDep,  file: UploadFile, enable_summarization: bool = False, credentials: dict = Depends(JWTBearer())):
+async def upload_file(commons: CommonsDep,  file: UploadFile, enable_summarization: bool = False, options: IngestionOptions = Depends(ingestion_options), credentials: dict = Depends(JWTBearer())):
     max_brain_size = os.getenv("MAX_BRAIN_SIZE")
    
     user = User(email=credentials.get('email', 'none'))
-    user_vectors_response = commons['supabase'].table("vectors").select(
+    # Uploads still queued or running count in full, whether or not some of their vectors are stored yet. Taken
+    # before the vectors are read, so a job finishing in between is not counted only by the vectors stored so far.
+    pending_jobs = {job.id: job for job in get_pending_jobs(user.email)}
+    user_vectors_response = await execute(commons['database'].table(vectors_table).select(
         "name:metadata->>file_name, size:metadata->>file_size", count="exact") \
-            .filter("user_id", "eq", user.email)\
-            .execute()
+            .filter("user_id", "eq", user.email))
     documents = user_vectors_response.data  # Access the data from the response
     # Convert each dictionary to a tuple of items, then to a set to remove duplicates, and then back to a dictionary
     user_unique_vectors = [dict(t) for t in set(tuple(d.items()) for d in documents)]
 
-    current_brain_size = sum(float(doc['size']) for doc in user_unique_vectors)
+    handle = await spool_upload(file)
+    file_size = handle.size
 
-    file_size = get_file_size(file)
+    # Uploads enqueued while the vectors were read and the file spooled count too. Nothing is awaited from here
+    # to the enqueue, so concurrent uploads of the user see each other.
+    pending_jobs.update((job.id, job) for job in get_pending_jobs(user.email))
+    pending_names = {job.name for job in pending_jobs.values()}
+    # A versioned upload replaces the stored version of the file
+    current_brain_size = sum(float(doc['size']) for doc in user_unique_vectors
+                             if doc['name'] not in pending_names
+                             and not (options.versioned and doc['name'] == file.filename))
+    current_brain_size += sum(job.size for job in pending_jobs.values())
 
     remaining_free_space =  float(max_brain_size) - (current_brain_size)
 
     if remaining_free_space - file_size < 0:
+        handle.remove()
         message = {"message": f"❌ User's brain will exceed maximum capacity with this upload. Maximum file allowed is : {convert_bytes(remaining_free_space)}", "type": "error"}
     else: 
-        message = await filter_file(file, enable_summarization, commons['supabase'], user)
+        try:
+            message = enqueue_ingestion(
+                user, file.filename, lambda: filter_file(handle, enable_summarization, commons['database'], user, options),
+                file_size)
+        except HTTPException:
+            handle.remove()
+            raise
  
     return message
 
 
-@app.post("/chat/", dependencies=[Depends(JWTBearer())])
-async def chat_endpoint(commons: CommonsDep, chat_message: ChatMessage, credentials: dict = Depends(JWTBearer())):
-    user = User(email=credentials.get('email', 'none'))
+async def count_request(database, user: User) -> bool:
+    '''Count the chat request of the user for today, False when they have reached their requests limit.'''
     date = time.strftime("%Y%m%d")
     max_requests_number = os.getenv("MAX_REQUESTS_NUMBER")
-    response = commons['supabase'].from_('users').select(
-    '*').filter("user_id", "eq", user.email).filter("date", "eq", date).execute()
+    response = await execute(database.from_('users').select(
+    '*').filter("user_id", "eq", user.email).filter("date", "eq", date))
 
 
     userItem = next(iter(response.data or []), {"requests_count": 0})
     old_request_count = userItem['requests_count']
 
+    if old_request_count == 0: 
+        await create_user(user_id= user.email, date=date)
+    elif  old_request_count <  float(max_requests_number) : 
+        await update_user_request_count(user_id=user.email,  date=date, requests_count= old_request_count+1)
+    else: 
+        return False
+    return True
+
+
+async def lookup_answer(user: User, chat_message: ChatMessage):
+    '''Look the question up in the answer cache, only a question asked without prior history can be answered
+    from it. Returns the key to store the answer under, None when it can't be cached, and the cached answer.'''
+    if chat_message.history:
+        return None, None
+    settings = (chat_message.model, chat_message.temperature, chat_message.max_tokens,
+                chat_message.use_summarization)
+    generation = answer_cache.generation(user.email)
+    question_embedding = await asyncio.to_thread(embed_question, chat_message.question)
+    cache_key = (settings, question_embedding, generation)
+    return cache_key, await asyncio.to_thread(answer_cache.get, user.email, settings, question_embedding)
+
+
+def store_answer(user: User, cache_key, answer: str):
+    if cache_key is not None:
+        settings, question_embedding, generation = cache_key
+        answer_cache.set(user.email, settings, question_embedding, answer, generation)
+
+
+async def summaries_context(database, chat_message: ChatMessage) -> str:
+    # 1. get summaries from the vector store based on question
+    summaries = await similarity_search(
+        chat_message.question, table='match_summaries')
+    # 2. evaluate summaries against the question
+    evaluations = await run_blocking(
+        llm_evaluate_summaries, chat_message.question, summaries, chat_message.model)
+    # 3. pull in the top documents from summaries
+    logger.info('Evaluations: %s', evaluations)
+    if not evaluations:
+        return ''
+    reponse = await execute(database.from_(vectors_content_table).select(
+        '*').in_('id', values=[e['document_id'] for e in evaluations]))
+    # 4. use top docs as additional context
+    return '---\nAdditional Context={}'.format(
+        '---\n'.join(data['content'] for data in reponse.data)
+    ) + '\n'
+
+
+async def run_until_disconnected(request: Request, coroutine):
+    '''Await the coroutine answering a chat, cancelled after chat_timeout seconds or once the client is gone.'''
+    task = asyncio.create_task(coroutine)
+    deadline = time.monotonic() + chat_timeout
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=min(disconnect_poll_interval, deadline - time.monotonic()))
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("Client disconnected, cancelling its chat")
+                raise HTTPException(status_code=499, detail="Client closed the request.")
+            if time.monotonic() >= deadline:
+                raise HTTPException(status_code=504, detail=f"No answer after {chat_timeout:g} seconds.")
+    finally:
+        task.cancel()
+
+
+@app.post("/chat/", dependencies=[Depends(JWTBearer())])
+async def chat_endpoint(request: Request, commons: CommonsDep, chat_message: ChatMessage, credentials: dict = Depends(JWTBearer())):
+    user = User(email=credentials.get('email', 'none'))
+    cache_key, answer = None, "You have reached your requests limit"
+    if await count_request(commons['database'], user):
+        cache_key, answer = await lookup_answer(user, chat_message)
+
     history = chat_message.history
     history.append(("user", chat_message.question))
+    if answer is not None:
+        history.append(("assistant", answer))
+        return {"history": history}
 
-    qa = get_qa_llm(chat_message, user.email)
+    async def answer_question():
+        qa = get_qa_llm(chat_message, user.email)
+        question = chat_message.question
+        if chat_message.use_summarization:
+            question = await summaries_context(commons['database'], chat_message) + question
+        return await acall_qa(qa, chat_message.model, question)
 
-    if old_request_count == 0: 
-        create_user(user_id= user.email, date=date)
-    elif  old_request_count <  float(max_requests_number) : 
-        update_user_request_count(user_id=user.email,  date=date, requests_count= old_request_count+1)
-    else: 
-        history.append(('assistant', "You have reached your requests limit"))
-        return {"history": history }
-
-
-    if chat_message.use_summarization:
-        # 1. get summaries from the vector store based on question
-        summaries = similarity_search(
-            chat_message.question, table='match_summaries')
-        # 2. evaluate summaries against the question
-        evaluations = llm_evaluate_summaries(
-            chat_message.question, summaries, chat_message.model)
-        # 3. pull in the top documents from summaries
-        logger.info('Evaluations: %s', evaluations)
-        if evaluations:
-            reponse = commons['supabase'].from_('vectors').select(
-                '*').in_('id', values=[e['document_id'] for e in evaluations]).execute()
-        # 4. use top docs as additional context
-            additional_context = '---\nAdditional Context={}'.format(
-                '---\n'.join(data['content'] for data in reponse.data)
-            ) + '\n'
-        model_response = qa(
-            {"question": additional_context + chat_message.question})
-    else:
-        model_response = qa({"question": chat_message.question})
-    history.append(("assistant", model_response["answer"]))
+    answer = await run_until_disconnected(request, answer_question())
+    history.append(("assistant", answer))
+    store_answer(user, cache_key, answer)
 
     return {"history": history}
 
 
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream", dependencies=[Depends(JWTBearer())])
+async def chat_stream_endpoint(commons: CommonsDep, chat_message: ChatMessage, credentials: dict = Depends(JWTBearer())):
+    '''Same as /chat/ as server-sent events: `sources` with the retrieved documents, a `token` event per piece of
+    the answer as the model generates it, then `history` with the final history.'''
+    user = User(email=credentials.get('email', 'none'))
+    cache_key, answer = None, "You have reached your requests limit"
+    if await count_request(commons['database'], user):
+        cache_key, answer = await lookup_answer(user, chat_message)
+
+    history = chat_message.history
+    history.append(("user", chat_message.question))
+
+    # The response is cancelled by starlette when the client disconnects, only the timeout is handled here
+    async def events():
+        nonlocal answer
+        if answer is None:
+            try:
+                async with asyncio.timeout(chat_timeout):
+                    qa = get_qa_llm(chat_message, user.email, streaming=True)
+                    question = chat_message.question
+                    if chat_message.use_summarization:
+                        question = await summaries_context(commons['database'], chat_message) + question
+                    async for event, data in stream_answer(qa, chat_message.model, question):
+                        if event == "sources":
+                            yield sse_event(event, [{"content": document.page_content, "metadata": document.metadata}
+                                                    for document in data])
+                        elif event == "token":
+                            yield sse_event(event, data)
+                        else:
+                            answer = data
+            except TimeoutError:
+                yield sse_event("error", f"No answer after {chat_timeout:g} seconds.")
+                return
+            store_answer(user, cache_key, answer)
+        else:
+            yield sse_event("token", answer)
+        history.append(("assistant", answer))
+        yield sse_event("history", history)
+
+    # Proxies must not buffer the events
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.post("/crawl/", dependencies=[Depends(JWTBearer())])
-async def crawl_endpoint(commons: CommonsDep, crawl_website: CrawlWebsite, enable_summarization: bool = False, credentials: dict = Depends(JWTBearer())):
+async def crawl_endpoint(commons: CommonsDep, crawl_website: CrawlWebsite, enable_summarization: bool = False, options: IngestionOptions = Depends(ingestion_options), credentials: dict = Depends(JWTBearer())):
     user = User(email=credentials.get('email', 'none'))
-    file_path, file_name = crawl_website.process()
 
-    # Create a SpooledTemporaryFile from the file_path
-    spooled_file = SpooledTemporaryFile()
-    with open(file_path, 'rb') as f:
-        shutil.copyfileobj(f, spooled_file)
+    return enqueue_ingestion(
+        user, crawl_website.url, lambda: filter_crawl(crawl_website, enable_summarization, commons['database'], user, options))
 
-    # Pass the SpooledTemporaryFile to UploadFile
-    file = UploadFile(file=spooled_file, filename=file_name)
-    message = await filter_file(file, enable_summarization, commons['supabase'], user=user)
-    return message
+
+@app.get("/jobs/{job_id}", dependencies=[Depends(JWTBearer())])
+async def job_endpoint(job_id: str, credentials: dict = Depends(JWTBearer())):
+    user = User(email=credentials.get('email', 'none'))
+    job = get_job(job_id)
+    if job is None or job.user_id != user.email:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return job
 
 
 @app.get("/explore", dependencies=[Depends(JWTBearer())])
 async def explore_endpoint(commons: CommonsDep,credentials: dict = Depends(JWTBearer()) ):
     user = User(email=credentials.get('email', 'none'))
-    response = commons['supabase'].table("vectors").select(
-        "name:metadata->>file_name, size:metadata->>file_size", count="exact").filter("user_id", "eq", user.email).execute()
+    response = await execute(commons['database'].table(vectors_table).select(
+        "name:metadata->>file_name, size:metadata->>file_size", count="exact").filter("user_id", "eq", user.email))
     documents = response.data  # Access the data from the response
     # Convert each dictionary to a tuple of items, then to a set to remove duplicates, and then back to a dictionary
     unique_data = [dict(t) for t in set(tuple(d.items()) for d in documents)]
@@ -148,23 +319,32 @@ async def explore_endpoint(commons: CommonsDep,credentials: dict = Depends(JWTBe
 async def delete_endpoint(commons: CommonsDep, file_name: str, credentials: dict = Depends(JWTBearer())):
     user = User(email=credentials.get('email', 'none'))
     # Cascade delete the summary from the database first, because it has a foreign key constraint
-    commons['supabase'].table("summaries").delete().match(
-        {"metadata->>file_name": file_name}).execute()
-    commons['supabase'].table("vectors").delete().match(
-        {"metadata->>file_name": file_name, "user_id": user.email}).execute()
+    await execute(commons['database'].table("summaries").delete().match(
+        {"metadata->>file_name": file_name}))
+    await execute(commons['database'].table(vectors_table).delete().match(
+        {"metadata->>file_name": file_name, "user_id": user.email}))
+    await adelete_orphan_chunks()
+    crawl_cache.forget(user.email, file_name)
+    answer_cache.invalidate(user.email)
     return {"message": f"{file_name} of user {user.email} has been deleted."}
 
 
 @app.get("/explore/{file_name}", dependencies=[Depends(JWTBearer())])
 async def download_endpoint(commons: CommonsDep, file_name: str,credentials: dict = Depends(JWTBearer()) ):
     user = User(email=credentials.get('email', 'none'))
-    response = commons['supabase'].table("vectors").select(
-        "metadata->>file_name, metadata->>file_size, metadata->>file_extension, metadata->>file_url", "content").match({"metadata->>file_name": file_name, "user_id": user.email}).execute()
+    response = await execute(commons['database'].table(vectors_content_table).select(
+        "metadata->>file_name, metadata->>file_size, metadata->>file_extension, metadata->>file_url", "content").match({"metadata->>file_name": file_name, "user_id": user.email}))
     documents = response.data
     # Returns all documents with the same file name
     return {"documents": documents}
 
 
+@app.get("/caches", dependencies=[Depends(JWTBearer())])
+async def caches_endpoint():
+    return {"embeddings": embedding_cache.stats(), "query_embeddings": query_embedding_cache.stats(),
+            "completions": completion_cache.stats(), "answers": answer_cache.stats()}
+
+
 @app.get("/")
 async def root():
     return {"status": "OK"}
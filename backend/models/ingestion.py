@@ -0,0 +1,16 @@
+from typing import Literal
+
+from pydantic import BaseModel
+
+
+class IngestionOptions(BaseModel):
+    # Size in tokens of the chunks embedded, and tokens shared by two consecutive chunks
+    chunk_size: int = 500
+    chunk_overlap: int = 0
+    # Token budget of the blocks of rows a CSV is grouped into, header included. 0 embeds rows one by one
+    csv_block_tokens: int = 1000
+    # Loader used for HTML uploads and crawled pages, see parsers/html.py
+    html_engine: Literal["fast", "unstructured"] = "unstructured"
+    # Replace the previous upload of the same file_name, only embedding the chunks that changed
+    versioned: bool = False
+
@@ -0,0 +1,26 @@
+import time
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+class IngestionJob(BaseModel):
+    id: str
+    user_id: str
+    name: str
+    # bytes of the uploaded file, counted in the brain size of the user until the job is finished
+    size: int = 0
+    # queued, running, done or failed
+    status: str = "queued"
+    # the step of the ingestion currently running (parsing, embedding, summarizing, ...)
+    stage: str = "queued"
+    bytes_processed: int = 0
+    chunks_embedded: int = 0
+    # duplicate and near duplicate chunks dropped before embedding
+    chunks_deduplicated: int = 0
+    # pages of PDFs skipped because their extraction timed out, their content is missing from the brain
+    pages_skipped: int = 0
+    # the message returned to the user once the job is finished
+    result: Optional[dict] = None
+    created_at: float = Field(default_factory=time.time)
+    updated_at: float = Field(default_factory=time.time)
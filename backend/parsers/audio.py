@@ -1,17 +1,19 @@
+import asyncio
 import os
-import tempfile
 import time
 from io import BytesIO
 from tempfile import NamedTemporaryFile
 
 import openai
-from fastapi import UploadFile
 from langchain.document_loaders import TextLoader
 from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from utils.file import compute_sha1_from_content
-from utils.vectors import documents_vector_store
+from models.ingestion import IngestionOptions
+from utils.file import IngestHandle, compute_sha1_from_content
+from utils.jobs import report_progress
+from utils.pipeline import iterate
+
+from .common import ingest_chunks, ingest_chunks_incrementally
+from .executor import split_text
 
 # # Create a function to transcribe audio using Whisper
 # def _transcribe_audio(api_key, audio_file, stats_db):
@@ -32,42 +34,29 @@ from utils.vectors import documents_vector_store
 #     return transcript
 
 # async def process_audio(upload_file: UploadFile, stats_db):
-async def process_audio(upload_file: UploadFile, enable_summarization: bool, user):
+async def process_audio(upload_file: IngestHandle, enable_summarization: bool, user, options: IngestionOptions):
 
     file_sha = ""
     dateshort = time.strftime("%Y%m%d-%H%M%S")
-    file_meta_name = f"audiotranscript_{dateshort}.txt"
-    # uploaded file to file object
+    # A versioned upload is stored under the name of the uploaded file so it replaces its previous transcript
+    file_meta_name = upload_file.filename if options.versioned else f"audiotranscript_{dateshort}.txt"
 
     openai_api_key = os.environ.get("OPENAI_API_KEY")
 
-    # Here, we're writing the uploaded file to a temporary file, so we can use it with your existing code.
-    with tempfile.NamedTemporaryFile(delete=False, suffix=upload_file.filename) as tmp_file:
-        await upload_file.seek(0)
-        content = await upload_file.read()
-        tmp_file.write(content)
-        tmp_file.flush()
-        tmp_file.close()
-
-        with open(tmp_file.name, "rb") as audio_file:
-            transcript = openai.Audio.transcribe("whisper-1", audio_file)
+    report_progress(stage="transcribing")
+    with open(upload_file.path, "rb") as audio_file:
+        transcript = await asyncio.to_thread(openai.Audio.transcribe, "whisper-1", audio_file)
 
     file_sha = compute_sha1_from_content(transcript.text.encode("utf-8"))
     file_size = len(transcript.text.encode("utf-8"))
 
-    # Load chunk size and overlap from sidebar
-    chunk_size = 500
-    chunk_overlap = 0
+    texts = await split_text(transcript.text, ".txt", options.chunk_size, options.chunk_overlap)
 
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    texts = text_splitter.split_text(transcript)
-
-    docs_with_metadata = [Document(page_content=text, metadata={"file_sha1": file_sha, "file_size": file_size, "file_name": file_meta_name,
-                                   "chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "date": dateshort}) for text in texts]
+    metadata = {"file_sha1": file_sha, "file_size": file_size, "file_name": file_meta_name,
+                "chunk_size": options.chunk_size, "chunk_overlap": options.chunk_overlap, "date": dateshort}
 
     # if st.secrets.self_hosted == "false":
     #     add_usage(stats_db, "embedding", "audio", metadata={"file_name": file_meta_name,"file_type": ".txt", "chunk_size": chunk_size, "chunk_overlap": chunk_overlap})
-    documents_vector_store.add_documents(docs_with_metadata)
-
-    return documents_vector_store
+    report_progress(stage="embedding", bytes_processed=upload_file.size)
+    ingest = ingest_chunks_incrementally if options.versioned else ingest_chunks
+    await ingest(iterate(texts), user, metadata, enable_summarization)
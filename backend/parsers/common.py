@@ -1,67 +1,169 @@
 # from stats import add_usage
 import asyncio
 import os
-import tempfile
 import time
-from typing import Optional
+from asyncio import ALL_COMPLETED, FIRST_COMPLETED
+from typing import (AsyncIterable, AsyncIterator, Callable, List, Optional,
+                    Tuple, Union)
 
-from fastapi import UploadFile
 from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from utils.file import compute_sha1_from_content, compute_sha1_from_file
-from utils.vectors import create_summary, create_vector, documents_vector_store
-
-
-async def process_file(file: UploadFile, loader_class, file_suffix, enable_summarization, user):
-    documents = []
-    file_name = file.filename
-    file_size = file.file._file.tell()  # Getting the size of the file
-    dateshort = time.strftime("%Y%m%d")
-
-    # Here, we're writing the uploaded file to a temporary file, so we can use it with your existing code.
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file.filename) as tmp_file:
-        await file.seek(0)
-        content = await file.read()
-        tmp_file.write(content)
-        tmp_file.flush()
-
-        loader = loader_class(tmp_file.name)
-        documents = loader.load()
-        # Ensure this function works with FastAPI
-        file_sha1 = compute_sha1_from_file(tmp_file.name)
-
-    os.remove(tmp_file.name)
-    chunk_size = 500
-    chunk_overlap = 0
-
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-
-    documents = text_splitter.split_documents(documents)
-
-    for doc in documents:
-        metadata = {
-            "file_sha1": file_sha1,
-            "file_size": file_size,
-            "file_name": file_name,
-            "chunk_size": chunk_size,
-            "chunk_overlap": chunk_overlap,
-            "date": dateshort,
-            "summarization": "true" if enable_summarization else "false"
-        }
-        doc_with_metadata = Document(
-            page_content=doc.page_content, metadata=metadata)
-        create_vector(user.email, doc_with_metadata)
-            #     add_usage(stats_db, "embedding", "audio", metadata={"file_name": file_meta_name,"file_type": ".txt", "chunk_size": chunk_size, "chunk_overlap": chunk_overlap})
-
-        if enable_summarization and ids and len(ids) > 0:
-            create_summary(ids[0], doc.page_content, metadata)
-    return
-
-
-async def file_already_exists(supabase, file, user):
-    file_content = await file.read()
-    file_sha1 = compute_sha1_from_content(file_content)
-    response = supabase.table("vectors").select("id").filter("metadata->>file_sha1", "eq", file_sha1) \
-        .filter("user_id", "eq", user.email).execute()
+from llm.summarization import (llm_summerize, summarization_concurrency,
+                               summarize_with_backoff)
+from logger import get_logger
+from models.ingestion import IngestionOptions
+from postgrest import AsyncPostgrestClient
+from utils.database import execute
+from utils.file import IngestHandle, compute_sha1_from_content
+from utils.jobs import report_progress
+from utils.pipeline import batched, bounded, dedup, iterate
+from utils.vectors import (delete_vectors, embedding_batch_size, get_chunk_ids,
+                           store_summaries, store_vectors,
+                           update_vectors_metadata, vectors_table)
+
+from .executor import iter_chunks, split_text
+from .html_text import extract_and_split
+
+logger = get_logger(__name__)
+
+
+# Splitters of the formats ingest_content extracts the text of, other formats are split as plain text
+content_splitters = {
+    ".html": extract_and_split,
+    ".htm": extract_and_split,
+}
+
+
+def build_metadata(file_sha1, file_size, file_name, enable_summarization, options: IngestionOptions):
+    return {
+        "file_sha1": file_sha1,
+        "file_size": file_size,
+        "file_name": file_name,
+        "chunk_size": options.chunk_size,
+        "chunk_overlap": options.chunk_overlap,
+        "date": time.strftime("%Y%m%d"),
+        "summarization": "true" if enable_summarization else "false"
+    }
+
+
+async def process_file(file: IngestHandle, loader_class, file_suffix, enable_summarization, user, options: IngestionOptions,
+                       chunk_source=iter_chunks, file_sha1: Optional[str] = None, extra_metadata: Optional[dict] = None):
+    '''Chunk the file in the parser pool and ingest it. `file_sha1` overrides the hash of the file, for content
+    hashed before it was written to disk.'''
+    metadata = build_metadata(file_sha1 or file.sha1, file.size, file.filename, enable_summarization, options)
+    metadata.update(extra_metadata or {})
+    report_progress(stage="processing")
+    chunks = chunk_source(loader_class, file.path, file_suffix, options.chunk_size, options.chunk_overlap)
+    ingest = ingest_chunks_incrementally if options.versioned else ingest_chunks
+    await ingest(chunks, user, metadata, enable_summarization)
+    report_progress(bytes_processed=file.size)
+    #     add_usage(stats_db, "embedding", "audio", metadata={"file_name": file_meta_name,"file_type": ".txt", "chunk_size": chunk_size, "chunk_overlap": chunk_overlap})
+
+
+async def ingest_content(content: Union[str, bytes, memoryview], file_name, enable_summarization, user,
+                         options: IngestionOptions = IngestionOptions(), file_sha1: Optional[str] = None,
+                         extra_metadata: Optional[dict] = None, incremental=False):
+    '''Ingest a document held in memory, such as a crawled page or generated text, without going through a file.
+    Bytes and memoryviews are hashed and decoded as UTF-8 in place, without an intermediate copy.
+    With `incremental`, a previous version of the document stored under the same file_name is updated in place.'''
+    if isinstance(content, str):
+        text, raw = content, memoryview(content.encode("utf-8"))
+    else:
+        raw = memoryview(content)
+        text = str(raw, "utf-8", "replace")
+    metadata = build_metadata(file_sha1 or compute_sha1_from_content(raw), raw.nbytes, file_name, enable_summarization,
+                              options)
+    metadata.update(extra_metadata or {})
+    del raw
+
+    report_progress(stage="processing")
+    file_extension = os.path.splitext(file_name)[1].lower()
+    texts = await split_text(text, file_extension, options.chunk_size, options.chunk_overlap,
+                             content_splitters.get(file_extension))
+    report_progress(bytes_processed=metadata["file_size"])
+    ingest = ingest_chunks_incrementally if incremental else ingest_chunks
+    await ingest(iterate(texts), user, metadata, enable_summarization)
+
+
+async def ingest_chunks(chunks: AsyncIterable[str], user, metadata, enable_summarization):
+    '''Dedup, embed and store the chunks batch by batch, then summarize them if enabled.
+    Every stage runs concurrently with the next one through a bounded queue, so memory doesn't grow with the document.'''
+    chunks = dedup(bounded(chunks))
+    stored_batches = bounded(store_batches(batched(chunks, embedding_batch_size), user, metadata), maxsize=2)
+    if enable_summarization:
+        await summarize_chunks(stored_batches, metadata)
+    else:
+        async for _ in stored_batches:
+            pass
+
+
+async def ingest_chunks_incrementally(chunks: AsyncIterable[str], user, metadata, enable_summarization):
+    '''Ingest a new version of a file: chunks already stored for its file_name are kept, only the new ones
+    are embedded, and the ones that disappeared are deleted.'''
+    existing = await asyncio.to_thread(get_chunk_ids, user.email, metadata["file_name"])
+    kept, kept_sha1s = [], set()
+
+    async def new_chunks():
+        async for text in chunks:
+            chunk_sha1 = compute_sha1_from_content(text.encode("utf-8"))
+            if chunk_sha1 in existing:
+                kept.extend((document_id, chunk_sha1) for document_id in existing.pop(chunk_sha1))
+                kept_sha1s.add(chunk_sha1)
+            elif chunk_sha1 not in kept_sha1s:
+                yield text
+
+    await ingest_chunks(new_chunks(), user, metadata, enable_summarization)
+    stale = [document_id for ids in existing.values() for document_id in ids]
+    # Kept chunks now belong to the new version of the file
+    await asyncio.to_thread(update_vectors_metadata, kept, metadata)
+    await asyncio.to_thread(delete_vectors, stale)
+    logger.info(f"{metadata['file_name']}: {len(kept)} chunks kept, {len(stale)} stale chunks deleted")
+
+
+async def summarize_chunks(stored_batches: AsyncIterable[List[Tuple[str, str]]], metadata,
+                           summarize: Callable[[str], str] = llm_summerize):
+    '''Summarize the stored chunks concurrently, within the process-wide SUMMARIZATION_CONCURRENCY limit,
+    and store the summaries in batches. A chunk that can't be summarized is only logged, its vector is kept.'''
+    async def summarize_chunk(document_id, text):
+        try:
+            return document_id, await summarize_with_backoff(text, summarize)
+        except Exception as e:
+            logger.error(f"Could not summarize chunk {document_id}: {e}")
+            return None
+
+    pending, summaries = set(), []
+
+    async def collect(return_when):
+        nonlocal pending
+        done, pending = await asyncio.wait(pending, return_when=return_when)
+        summaries.extend(summary for summary in (task.result() for task in done) if summary)
+        # Summaries are embedded and inserted by full batches, the last one once every chunk is summarized
+        while len(summaries) >= embedding_batch_size or (summaries and not pending):
+            batch = summaries[:embedding_batch_size]
+            del summaries[:embedding_batch_size]
+            await store_summaries(batch, dict(metadata))
+
+    try:
+        async for stored in stored_batches:
+            for document_id, text in stored:
+                pending.add(asyncio.create_task(summarize_chunk(document_id, text)))
+                # Stop pulling chunks when enough of them are waiting for a slot
+                if len(pending) >= 2 * summarization_concurrency:
+                    await collect(FIRST_COMPLETED)
+        if pending:
+            await collect(ALL_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def store_batches(batches: AsyncIterable[List[str]], user, metadata) -> AsyncIterator[List[Tuple[str, str]]]:
+    async for texts in batches:
+        docs = [Document(page_content=text, metadata=metadata) for text in texts]
+        ids = await store_vectors(user.email, docs)
+        yield list(zip(ids, texts))
+
+
+async def file_already_exists(database: AsyncPostgrestClient, file_sha1, user):
+    response = await execute(database.table(vectors_table).select("id").filter("metadata->>file_sha1", "eq", file_sha1)
+                             .filter("user_id", "eq", user.email).limit(1))
     return len(response.data) > 0
@@ -1,8 +1,16 @@
-from fastapi import UploadFile
 from langchain.document_loaders.csv_loader import CSVLoader
+from models.ingestion import IngestionOptions
+from utils.file import IngestHandle
 
 from .common import process_file
+from .csv_blocks import iter_csv_blocks
 
 
-def process_csv(file: UploadFile, enable_summarization, user):
-    return process_file(file, CSVLoader, ".csv", enable_summarization, user)
+def process_csv(file: IngestHandle, enable_summarization, user, options: IngestionOptions):
+    if not options.csv_block_tokens:
+        return process_file(file, CSVLoader, ".csv", enable_summarization, user, options)
+
+    def csv_blocks(loader_class, file_path, file_extension, chunk_size, chunk_overlap):
+        return iter_csv_blocks(file_path, file_extension, options.csv_block_tokens)
+
+    return process_file(file, CSVLoader, ".csv", enable_summarization, user, options, chunk_source=csv_blocks)
@@ -0,0 +1,55 @@
+import csv
+import io
+from functools import partial
+from typing import AsyncIterator, Iterator, List
+
+from utils.chunking import get_encoding
+
+from .executor import spill_chunks, stream_from_pool
+
+# This module is imported by the parser processes, keep its imports light.
+
+
+def _format_row(row: List[str]) -> str:
+    line = io.StringIO()
+    csv.writer(line, lineterminator="\n").writerow(row)
+    return line.getvalue()
+
+
+def _iter_blocks(file_path, block_tokens) -> Iterator[str]:
+    encoding = get_encoding()
+    with open(file_path, newline="", encoding="utf-8", errors="replace") as csv_file:
+        rows = csv.reader(csv_file)
+        header = _format_row(next(rows, []))
+        header_tokens = encoding.encode(header)
+        # The header can take at most half of the budget, a longer one is truncated so the blocks still hold rows
+        max_header_tokens = block_tokens // 2
+        if len(header_tokens) > max_header_tokens:
+            header = encoding.decode(header_tokens[:max_header_tokens]).rstrip("\n") + "\n"
+            header_tokens = encoding.encode(header)
+        budget = max(1, block_tokens - len(header_tokens))
+        block, block_size = [], 0
+        for row in rows:
+            line = _format_row(row)
+            tokens = encoding.encode(line)
+            if block and block_size + len(tokens) > budget:
+                yield header + "".join(block)
+                block, block_size = [], 0
+            if len(tokens) > budget:
+                # A single row over the budget is cut into several blocks, each with the header
+                for start in range(0, len(tokens), budget):
+                    yield header + encoding.decode(tokens[start:start + budget])
+                continue
+            block.append(line)
+            block_size += len(tokens)
+        if block:
+            yield header + "".join(block)
+
+
+def _spill_blocks(file_path, block_tokens) -> str:
+    return spill_chunks(_iter_blocks(file_path, block_tokens))
+
+
+def iter_csv_blocks(file_path, file_extension, block_tokens) -> AsyncIterator[str]:
+    '''Stream the CSV in the parser pool as blocks of rows of at most `block_tokens` tokens, repeating the header.'''
+    return stream_from_pool(file_extension, partial(_spill_blocks, file_path, block_tokens))
@@ -1,8 +1,9 @@
-from fastapi import UploadFile
 from langchain.document_loaders import Docx2txtLoader
+from models.ingestion import IngestionOptions
+from utils.file import IngestHandle
 
 from .common import process_file
 
 
-def process_docx(file: UploadFile, enable_summarization, user):
-    return process_file(file, Docx2txtLoader, ".docx", enable_summarization, user)
+def process_docx(file: IngestHandle, enable_summarization, user, options: IngestionOptions):
+    return process_file(file, Docx2txtLoader, ".docx", enable_summarization, user, options)
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+from logger import get_logger
+from utils.chunking import get_chunker
+
+logger = get_logger(__name__)
+
+parser_processes = int(os.environ.get("PARSER_PROCESSES", os.cpu_count() or 1))
+parser_timeout = float(os.environ.get("PARSER_TIMEOUT", 300))
+# Files of a single format can't take more than this many processes at once, so one heavy format
+# can't starve the others. Overridden per format with e.g. PARSER_CONCURRENCY=".pdf:2,.epub:1"
+default_format_concurrency = max(1, parser_processes // 2)
+format_concurrency = {
+    extension: int(limit)
+    for extension, limit in (
+        item.split(":") for item in os.environ.get("PARSER_CONCURRENCY", "").split(",") if item
+    )
+}
+
+_executor: Optional[ProcessPoolExecutor] = None
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+class TimeLimitExceeded(BaseException):
+    # Not an Exception, so a parser can't swallow it while recovering from malformed input
+    pass
+
+
+def _raise_time_limit(signum, frame):
+    raise TimeLimitExceeded()
+
+
+@contextmanager
+def time_limit(seconds: float):
+    '''Interrupt the block with TimeLimitExceeded after `seconds` of work in the parser process. Without SIGALRM
+    (Windows) the block is not limited.'''
+    if seconds <= 0 or not hasattr(signal, "SIGALRM"):
+        yield
+        return
+    previous_handler = signal.signal(signal.SIGALRM, _raise_time_limit)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def _run_with_time_limit(function, seconds):
+    '''Run `function` in the parser process and stop it after `seconds`, so a parse that timed out doesn't keep
+    the process busy.'''
+    try:
+        with time_limit(seconds):
+            return function()
+    except TimeLimitExceeded:
+        raise TimeoutError(f"Parsing took more than {seconds}s") from None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # Spawn rather than fork, the server process holds threads and open connections
+        _executor = ProcessPoolExecutor(
+            max_workers=parser_processes, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _get_semaphore(file_extension: str) -> asyncio.Semaphore:
+    if file_extension not in _semaphores:
+        _semaphores[file_extension] = asyncio.Semaphore(
+            format_concurrency.get(file_extension, default_format_concurrency))
+    return _semaphores[file_extension]
+
+
+def _load_and_split(loader_class, file_path, chunk_size, chunk_overlap) -> str:
+    '''Split the file document by document, spilling the chunks to a JSON lines file the server process streams.'''
+    loader = loader_class(file_path)
+    try:
+        documents = loader.lazy_load()
+    except NotImplementedError:
+        documents = loader.load()
+    splitter = get_chunker(chunk_size, chunk_overlap)
+    return spill_chunks(text for document in documents for text in splitter.split_text(document.page_content))
+
+
+def spill_chunks(chunks: Iterable[str]) -> str:
+    '''Write the chunks to a JSON lines file as they are produced and return its path, for stream_from_pool.'''
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as chunks_file:
+        try:
+            for text in chunks:
+                chunks_file.write(json.dumps(text) + "\n")
+        except BaseException:
+            # Interrupted by the time limit or failed, nobody will stream the file
+            os.remove(chunks_file.name)
+            raise
+    return chunks_file.name
+
+
+def _split_text(text, chunk_size, chunk_overlap) -> List[str]:
+    return get_chunker(chunk_size, chunk_overlap).split_text(text)
+
+
+@asynccontextmanager
+async def format_slot(file_extension: str):
+    '''Hold one of the slots allowed for the format while a file of that format is being parsed.'''
+    async with _get_semaphore(file_extension):
+        yield
+
+
+async def run_in_pool(function, timeout: Optional[float] = parser_timeout):
+    '''Run `function` in the pool and raise TimeoutError after `timeout` seconds of work, None lets it take however
+    long it needs. The parser process interrupts the function itself, the time waiting for a free process doesn't
+    count. Without SIGALRM (Windows) the wait is abandoned instead, counting from the submission, and the process
+    keeps working on it.'''
+    loop = asyncio.get_running_loop()
+    if timeout is None:
+        return await loop.run_in_executor(_get_executor(), function)
+    if hasattr(signal, "SIGALRM"):
+        return await loop.run_in_executor(_get_executor(), partial(_run_with_time_limit, function, timeout))
+    return await asyncio.wait_for(loop.run_in_executor(_get_executor(), function), timeout)
+
+
+async def run_parser(file_extension: str, function):
+    '''Run `function` in the pool within the slots of the format and the parser timeout.'''
+    async with format_slot(file_extension):
+        try:
+            return await run_in_pool(function)
+        except asyncio.TimeoutError:
+            logger.error(f"Parsing a {file_extension} file took more than {parser_timeout}s")
+            raise
+
+
+async def stream_from_pool(file_extension: str, function) -> AsyncIterator[str]:
+    '''Run `function`, which returns the path written by spill_chunks, in the pool and stream the chunks back.'''
+    chunks_path = await run_parser(file_extension, function)
+    try:
+        with open(chunks_path) as chunks_file:
+            for line in chunks_file:
+                yield json.loads(line)
+    finally:
+        os.remove(chunks_path)
+
+
+def iter_chunks(loader_class, file_path, file_extension, chunk_size, chunk_overlap) -> AsyncIterator[str]:
+    '''Load the file with the langchain loader and split it into chunks in the parser process pool.'''
+    return stream_from_pool(
+        file_extension, partial(_load_and_split, loader_class, file_path, chunk_size, chunk_overlap))
+
+
+async def split_text(text, file_extension, chunk_size, chunk_overlap, splitter=None) -> List[str]:
+    '''Split text held in memory in the pool, with `splitter(text, chunk_size, chunk_overlap)` when the format
+    needs more than plain text splitting.'''
+    return await run_parser(file_extension, partial(splitter or _split_text, text, chunk_size, chunk_overlap))
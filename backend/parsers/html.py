@@ -1,17 +1,44 @@
-import os
 import re
 import tempfile
 import unicodedata
 
 import requests
-from fastapi import UploadFile
 from langchain.document_loaders import UnstructuredHTMLLoader
+from models.ingestion import IngestionOptions
+from utils.file import IngestHandle, ingest_handle_from_path
 
-from .common import process_file
+from .common import ingest_content, process_file
+from .html_text import FastHTMLLoader
 
 
-def process_html(file: UploadFile, enable_summarization, user):
-    return process_file(file, UnstructuredHTMLLoader, ".html", enable_summarization, user)
+html_loaders = {
+    "fast": FastHTMLLoader,
+    "unstructured": UnstructuredHTMLLoader,
+}
+
+
+def process_html(file: IngestHandle, enable_summarization, user, options: IngestionOptions):
+    return process_file(file, html_loaders[options.html_engine], ".html", enable_summarization, user, options)
+
+
+async def process_html_page(url, html: str, file_sha1, enable_summarization, user, options: IngestionOptions):
+    '''Ingest a crawled page straight from memory. Chunks of a previous version of the page that are still
+    there are kept, so a recrawl only embeds what changed.'''
+    file_name = slugify(url) + ".html"
+    if options.html_engine != "fast":
+        # Other engines only read files, the page goes through a temporary one
+        with tempfile.NamedTemporaryFile("w", delete=False, suffix=file_name) as tmp_file:
+            tmp_file.write(html)
+        file = ingest_handle_from_path(tmp_file.name, file_name)
+        try:
+            return await process_file(file, html_loaders[options.html_engine], ".html", enable_summarization, user,
+                                      options.copy(update={"versioned": True}), file_sha1=file_sha1,
+                                      extra_metadata={"file_url": url})
+        finally:
+            file.remove()
+
+    await ingest_content(html, file_name, enable_summarization, user, options, file_sha1=file_sha1,
+                         extra_metadata={"file_url": url}, incremental=True)
 
 
 def get_html(url):
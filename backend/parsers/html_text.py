@@ -0,0 +1,91 @@
+import re
+from html.parser import HTMLParser
+from typing import List, Tuple
+
+from langchain.docstore.document import Document
+from langchain.document_loaders.base import BaseLoader
+from utils.chunking import get_chunker
+
+# This module is imported by the parser processes, keep its imports light.
+
+# Content of these tags is never visible text or is page boilerplate
+_SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg", "head", "iframe",
+                 "nav", "footer", "aside"}
+_BLOCK_TAGS = {"p", "div", "section", "article", "main", "header", "form", "blockquote", "pre", "br", "hr",
+               "h1", "h2", "h3", "h4", "h5", "h6", "ul", "ol", "li", "dl", "dt", "dd",
+               "table", "tr", "td", "th", "caption", "figure", "figcaption"}
+_VOID_TAGS = {"br", "hr", "img", "input", "meta", "link", "area", "base", "col", "embed",
+              "param", "source", "track", "wbr"}
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        # Open elements with whether their content is skipped, an end tag closes the elements left open
+        # inside it so an unclosed skipped tag can't hide the rest of the page
+        self._open: List[Tuple[str, bool]] = []
+        self._skip_depth = 0
+
+    def _is_skipped(self, tag) -> bool:
+        if tag == "header":
+            # The banner of the page, not the header of an article or a section. Elements outside an explicit
+            # body belong to the implicit one.
+            parent = self._open[-1][0] if self._open else None
+            return parent in (None, "html", "body")
+        return tag in _SKIPPED_TAGS
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_TAGS:
+            if tag in _BLOCK_TAGS and not self._skip_depth:
+                self.parts.append("\n")
+            return
+        skipped = self._is_skipped(tag)
+        self._open.append((tag, skipped))
+        if skipped:
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS and not self._skip_depth:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if not any(open_tag == tag for open_tag, _ in self._open):
+            return
+        while True:
+            open_tag, skipped = self._open.pop()
+            if skipped:
+                self._skip_depth -= 1
+            if open_tag == tag:
+                break
+        if tag in _BLOCK_TAGS and not self._skip_depth:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            # Line breaks in the source are plain whitespace, only block tags start a new line
+            self.parts.append(re.sub(r"\s+", " ", data))
+
+
+def extract_text(html: str) -> str:
+    '''Return the visible text of the page, one line per block, without scripts, navigation and footers.'''
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    lines = (re.sub(r" +", " ", line).strip() for line in "".join(extractor.parts).split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+def extract_and_split(html: str, chunk_size, chunk_overlap) -> List[str]:
+    return get_chunker(chunk_size, chunk_overlap).split_text(extract_text(html))
+
+
+class FastHTMLLoader(BaseLoader):
+    '''A lightweight alternative to UnstructuredHTMLLoader built on the standard library HTML parser.'''
+
+    def __init__(self, file_path: str, encoding: str = "utf-8"):
+        self.file_path = file_path
+        self.encoding = encoding
+
+    def load(self) -> List[Document]:
+        with open(self.file_path, encoding=self.encoding, errors="replace") as html_file:
+            text = extract_text(html_file.read())
+        return [Document(page_content=text, metadata={"source": self.file_path})]
@@ -1,8 +1,9 @@
-from fastapi import UploadFile
 from langchain.document_loaders import NotebookLoader
+from models.ingestion import IngestionOptions
+from utils.file import IngestHandle
 
 from .common import process_file
 
 
-def process_ipnyb(file: UploadFile, enable_summarization, user):
-    return process_file(file, NotebookLoader, "ipynb", enable_summarization, user)
+def process_ipnyb(file: IngestHandle, enable_summarization, user, options: IngestionOptions):
+    return process_file(file, NotebookLoader, ".ipynb", enable_summarization, user, options)
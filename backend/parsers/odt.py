@@ -1,8 +1,9 @@
-from fastapi import UploadFile
 from langchain.document_loaders import UnstructuredODTLoader
+from models.ingestion import IngestionOptions
+from utils.file import IngestHandle
 
 from .common import process_file
 
 
-def process_odt(file: UploadFile, enable_summarization, user):
-    return process_file(file, UnstructuredODTLoader, ".odt", enable_summarization, user)
+def process_odt(file: IngestHandle, enable_summarization, user, options: IngestionOptions):
+    return process_file(file, UnstructuredODTLoader, ".odt", enable_summarization, user, options)
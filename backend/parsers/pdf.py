@@ -1,8 +1,17 @@
-from fastapi import UploadFile
+import os
+
 from langchain.document_loaders import PyPDFLoader
+from models.ingestion import IngestionOptions
+from utils.file import IngestHandle
 
 from .common import process_file
+from .executor import iter_chunks
+from .pdf_pages import iter_pdf_chunks
+
+# Extract pages in parallel across the parser processes instead of loading the whole file in one
+pdf_parallel_extraction = os.environ.get("PDF_PARALLEL_EXTRACTION", "true") == "true"
 
 
-def process_pdf(file: UploadFile, enable_summarization, user):
-    return process_file(file, PyPDFLoader, ".pdf", enable_summarization, user)
+def process_pdf(file: IngestHandle, enable_summarization, user, options: IngestionOptions):
+    chunk_source = iter_pdf_chunks if pdf_parallel_extraction else iter_chunks
+    return process_file(file, PyPDFLoader, ".pdf", enable_summarization, user, options, chunk_source=chunk_source)
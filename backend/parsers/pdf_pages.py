@@ -0,0 +1,88 @@
+import asyncio
+import os
+from collections import deque
+from functools import partial
+from typing import AsyncIterator, List, Tuple
+
+from logger import get_logger
+from pypdf import PdfReader
+from utils.chunking import get_chunker
+
+from .executor import TimeLimitExceeded, format_slot, parser_processes, run_in_pool, time_limit
+
+# This module is imported by the parser processes, keep its imports light.
+
+logger = get_logger(__name__)
+
+pdf_pages_per_task = int(os.environ.get("PDF_PAGES_PER_TASK", 8))
+# Pages past this cap are ignored, 0 means no cap
+pdf_max_pages = int(os.environ.get("PDF_MAX_PAGES", 0))
+# Seconds of extraction a page can take before it is skipped, 0 means no limit
+pdf_page_timeout = float(os.environ.get("PDF_PAGE_TIMEOUT", 30))
+# Page ranges of a single PDF extracted at the same time
+pdf_parallel_tasks = int(os.environ.get("PDF_PARALLEL_TASKS", parser_processes))
+
+
+def _count_pages(file_path) -> int:
+    return len(PdfReader(file_path).pages)
+
+
+def _extract_pages(file_path, start, end, chunk_size, chunk_overlap, page_timeout) -> Tuple[List[str], List[int]]:
+    '''Return the chunks of the pages of the range and the numbers of the pages skipped after `page_timeout`.'''
+    reader = PdfReader(file_path)
+    splitter = get_chunker(chunk_size, chunk_overlap)
+    chunks, skipped_pages = [], []
+    for number, page in enumerate(reader.pages[start:end], start + 1):
+        try:
+            # The clock starts with the page, not when its range was submitted to the pool
+            with time_limit(page_timeout):
+                text = page.extract_text()
+        except TimeLimitExceeded:
+            # A pathological page must not stall the whole document, the process moves on to the next one
+            skipped_pages.append(number)
+            continue
+        chunks.extend(splitter.split_text(text))
+    return chunks, skipped_pages
+
+
+async def iter_pdf_chunks(loader_class, file_path, file_extension, chunk_size, chunk_overlap) -> AsyncIterator[str]:
+    '''Extract page ranges of the PDF in parallel in the parser pool and yield their chunks in page order.
+    `loader_class` is unused, pages are read with pypdf directly like PyPDFLoader does. Each range holds one
+    of the slots of the format while it is extracted.'''
+    # Imported here, the parser processes import this module and don't need the jobs
+    from utils.jobs import report_progress
+
+    page_count = await asyncio.to_thread(_count_pages, file_path)
+    if pdf_max_pages and page_count > pdf_max_pages:
+        logger.info(f"Only the first {pdf_max_pages} of {page_count} pages of {file_path} are processed")
+        page_count = pdf_max_pages
+
+    async def extract(start):
+        end = min(start + pdf_pages_per_task, page_count)
+        async with format_slot(file_extension):
+            # The time limit is enforced page by page in the process, time spent in the queue doesn't count
+            return await run_in_pool(
+                partial(_extract_pages, file_path, start, end, chunk_size, chunk_overlap, pdf_page_timeout),
+                timeout=None)
+
+    async def collect(extraction) -> List[str]:
+        chunks, skipped_pages = await extraction
+        if skipped_pages:
+            logger.warning(f"Skipped pages {skipped_pages} of {file_path}, their extraction timed out")
+            report_progress(pages_skipped=len(skipped_pages))
+        return chunks
+
+    pending = deque()
+    try:
+        for start in range(0, page_count, pdf_pages_per_task):
+            pending.append(asyncio.ensure_future(extract(start)))
+            if len(pending) < pdf_parallel_tasks:
+                continue
+            for chunk in await collect(pending.popleft()):
+                yield chunk
+        while pending:
+            for chunk in await collect(pending.popleft()):
+                yield chunk
+    finally:
+        for extraction in pending:
+            extraction.cancel()
@@ -1,8 +1,9 @@
-from fastapi import UploadFile
 from langchain.document_loaders import TextLoader
+from models.ingestion import IngestionOptions
+from utils.file import IngestHandle
 
 from .common import process_file
 
 
-async def process_txt(file: UploadFile, enable_summarization, user):
-    return await process_file(file, TextLoader, ".txt", enable_summarization, user)
+async def process_txt(file: IngestHandle, enable_summarization, user, options: IngestionOptions):
+    return await process_file(file, TextLoader, ".txt", enable_summarization, user, options)
@@ -0,0 +1,49 @@
+import os
+import re
+import sys
+import tempfile
+
+import pytest
+
+# Modules import each other from the backend directory, like in the container
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Settings read when the modules are imported: caches go to a scratch directory, clients need credentials
+_scratch = tempfile.mkdtemp(prefix="quivr-tests-")
+for name in ("EMBEDDING_CACHE_PATH", "COMPLETION_CACHE_PATH", "CRAWL_CACHE_PATH"):
+    os.environ.setdefault(name, os.path.join(_scratch, name.lower() + ".sqlite3"))
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+# The supabase client only checks that the key looks like a JWT
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoidGVzdCJ9.dGVzdA")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+class WordEncoding:
+    '''A stand-in for a tiktoken encoding with one token per word and its trailing whitespace, so tests can count
+    tokens by hand and don't need to download the real encoders.'''
+
+    def __init__(self):
+        self._ids = {}
+        self._tokens = []
+
+    def _token(self, piece: str) -> int:
+        if piece not in self._ids:
+            self._ids[piece] = len(self._tokens)
+            self._tokens.append(piece)
+        return self._ids[piece]
+
+    def encode(self, text: str):
+        return [self._token(piece) for piece in re.findall(r"\s+|\S+\s*", text)]
+
+    encode_ordinary = encode
+
+    def decode(self, tokens) -> str:
+        return "".join(self._tokens[token] for token in tokens)
+
+    def decode_single_token_bytes(self, token: int) -> bytes:
+        return self._tokens[token].encode("utf-8")
+
+
+@pytest.fixture
+def word_encoding():
+    return WordEncoding()
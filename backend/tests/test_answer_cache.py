@@ -0,0 +1,54 @@
+from utils.answer_cache import AnswerCache
+
+SETTINGS = ("gpt-3.5-turbo", 0.0, 256)
+
+
+def make_cache(**kwargs):
+    options = {"max_entries": 100, "threshold": 0.97, "ttl": 0, "max_entries_per_user": 10}
+    options.update(kwargs)
+    return AnswerCache(**options)
+
+
+def test_a_close_question_with_the_same_settings_gets_the_cached_answer():
+    cache = make_cache()
+    cache.set("user", SETTINGS, [1.0, 0.0, 0.0], "answer", cache.generation("user"))
+    # Only the direction counts, the length of the embedding doesn't
+    assert cache.get("user", SETTINGS, [2.0, 0.1, 0.0]) == "answer"
+    assert cache.get("user", SETTINGS, [1.0, 1.0, 0.0]) is None
+    assert cache.get("user", ("gpt-4", 0.0, 256), [1.0, 0.0, 0.0]) is None
+    assert cache.get("other user", SETTINGS, [1.0, 0.0, 0.0]) is None
+    assert cache.get("user", SETTINGS, [0.0, 0.0, 0.0]) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 4
+
+
+def test_the_closest_answer_is_served():
+    cache = make_cache(threshold=0.9)
+    cache.set("user", SETTINGS, [1.0, 0.3], "further", 0)
+    cache.set("user", SETTINGS, [1.0, 0.1], "closer", 0)
+    assert cache.get("user", SETTINGS, [1.0, 0.0]) == "closer"
+
+
+def test_each_user_keeps_its_most_recently_used_answers():
+    cache = make_cache(max_entries_per_user=2)
+    cache.set("user", SETTINGS, [1.0, 0.0, 0.0], "first", 0)
+    cache.set("user", SETTINGS, [0.0, 1.0, 0.0], "second", 0)
+    cache.set("other user", SETTINGS, [1.0, 0.0, 0.0], "other", 0)
+    assert cache.get("user", SETTINGS, [1.0, 0.0, 0.0]) == "first"
+    cache.set("user", SETTINGS, [0.0, 0.0, 1.0], "third", 0)
+    assert cache.get("user", SETTINGS, [0.0, 1.0, 0.0]) is None
+    assert cache.get("user", SETTINGS, [1.0, 0.0, 0.0]) == "first"
+    assert cache.get("other user", SETTINGS, [1.0, 0.0, 0.0]) == "other"
+    assert cache.stats()["entries"] == 3
+
+
+def test_invalidation_drops_the_answers_computed_before_it():
+    cache = make_cache()
+    generation = cache.generation("user")
+    cache.set("user", SETTINGS, [1.0, 0.0], "answer", generation)
+    cache.invalidate("user")
+    assert cache.get("user", SETTINGS, [1.0, 0.0]) is None
+    # An answer computed while the vectors of the user changed is not stored
+    cache.set("user", SETTINGS, [1.0, 0.0], "stale answer", generation)
+    assert cache.get("user", SETTINGS, [1.0, 0.0]) is None
+    cache.set("user", SETTINGS, [1.0, 0.0], "fresh answer", cache.generation("user"))
+    assert cache.get("user", SETTINGS, [1.0, 0.0]) == "fresh answer"
@@ -0,0 +1,29 @@
+from utils.chunking import TokenChunker
+
+
+def test_chunks_stay_within_the_token_budget(word_encoding):
+    text = " ".join(f"word{index}" for index in range(250))
+    chunks = TokenChunker(40, 0, word_encoding).split_text(text)
+    assert all(len(word_encoding.encode(chunk)) <= 40 for chunk in chunks)
+    assert " ".join(chunks).split() == text.split()
+
+
+def test_chunks_are_cut_at_the_strongest_boundary(word_encoding):
+    paragraph = " ".join(["alpha"] * 15) + "."
+    text = "\n\n".join([paragraph] * 3)
+    chunks = TokenChunker(40, 0, word_encoding).split_text(text)
+    assert chunks == [paragraph + "\n\n" + paragraph, paragraph]
+
+
+def test_consecutive_chunks_overlap(word_encoding):
+    words = [f"w{index}" for index in range(100)]
+    chunks = TokenChunker(20, 5, word_encoding).split_text(" ".join(words))
+    for chunk, following in zip(chunks, chunks[1:]):
+        assert chunk.split()[-5:] == following.split()[:5]
+    assert chunks[-1].split()[-1] == "w99"
+
+
+def test_multibyte_characters_are_never_cut(word_encoding):
+    text = " ".join(["éléphant"] * 60)
+    chunks = TokenChunker(16, 0, word_encoding).split_text(text)
+    assert " ".join(chunks).split() == text.split()
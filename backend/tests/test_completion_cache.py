@@ -0,0 +1,61 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+from utils import completion_cache
+from utils.completion_cache import CompletionCache, completion_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=0.0)
+    monkeypatch.setattr(completion_cache, "time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+def make_cache(tmp_path, max_entries=10, ttl=0):
+    return CompletionCache(str(tmp_path / "completions.sqlite3"), max_entries, ttl)
+
+
+def test_completions_are_keyed_by_prompt_parameters_and_model(tmp_path):
+    cache = make_cache(tmp_path)
+    key = completion_key("Summarize {document}", document="text", temperature=0.2)
+    assert key == completion_key("Summarize {document}", temperature=0.2, document="text")
+    assert key != completion_key("Summarize {document}", document="text", temperature=0.7)
+    cache.set("gpt-3.5-turbo", key, "a summary")
+    assert cache.get("gpt-3.5-turbo", key) == "a summary"
+    assert cache.get("gpt-4", key) is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_expired_completions_are_not_served(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl=60)
+    cache.set("model", "key", "completion")
+    clock.value = 59
+    assert cache.get("model", "key") == "completion"
+    clock.value = 61
+    assert cache.get("model", "key") is None
+
+
+def test_least_recently_used_completions_are_evicted(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    ticks = itertools.count()
+    for index in range(10):
+        clock.value = next(ticks)
+        cache.set("model", f"key{index}", str(index))
+    clock.value = next(ticks)
+    cache.get("model", "key0")
+    clock.value = next(ticks)
+    cache.set("model", "key10", "10")
+    kept = [index for index in range(11) if cache.get("model", f"key{index}") is not None]
+    assert kept == [0, *range(3, 11)]
+
+
+def test_clear_drops_the_completions_of_a_model(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("model-a", "key", "a")
+    cache.set("model-b", "key", "b")
+    cache.clear("model-a")
+    assert cache.get("model-a", "key") is None and cache.get("model-b", "key") == "b"
+    cache.clear()
+    assert cache.get("model-b", "key") is None
@@ -0,0 +1,86 @@
+import asyncio
+
+import httpx
+from crawl.cache import CrawlCache
+from crawl.crawler import CrawlWebsite
+
+# A small site: index links to two pages and to another host, page a links one level further
+SITE = {
+    "/": '<a href="/a">A</a> <a href="/b#top">B</a> <a href="https://elsewhere.test/x">X</a>',
+    "/a": '<p>Page A</p><a href="/c">C</a>',
+    "/b": "<p>Page B</p>",
+    "/c": "<p>Page C</p>",
+}
+
+
+def site_transport(requests=None):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if requests is not None:
+            requests.append(request)
+        if request.url.host != "site.test" or request.url.path not in SITE:
+            return httpx.Response(404)
+        if request.headers.get("if-none-match") == f'"{request.url.path}"':
+            return httpx.Response(304)
+        return httpx.Response(200, html=SITE[request.url.path], headers={"etag": f'"{request.url.path}"'})
+    return httpx.MockTransport(handler)
+
+
+def crawl(website: CrawlWebsite, transport, **kwargs):
+    async def collect():
+        async with httpx.AsyncClient(transport=transport, follow_redirects=True) as client:
+            return [page async for page in website.crawl(client=client, **kwargs)]
+    return asyncio.run(collect())
+
+
+def test_depth_limits_the_levels_fetched():
+    assert [page.url for page in crawl(CrawlWebsite(url="http://site.test/", depth=1), site_transport())] == [
+        "http://site.test/"]
+    pages = crawl(CrawlWebsite(url="http://site.test/", depth=2), site_transport())
+    assert sorted(page.url for page in pages) == ["http://site.test/", "http://site.test/a", "http://site.test/b"]
+    pages = crawl(CrawlWebsite(url="http://site.test/", depth=3), site_transport())
+    assert len(pages) == 4
+
+
+def test_max_pages_stops_the_crawl():
+    pages = crawl(CrawlWebsite(url="http://site.test/", depth=3, max_pages=2), site_transport())
+    assert len(pages) == 2
+
+
+def test_links_to_other_hosts_are_not_followed():
+    requests = []
+    crawl(CrawlWebsite(url="http://site.test/", depth=3), site_transport(requests))
+    assert {request.url.host for request in requests} == {"site.test"}
+    # Fragments are dropped, /b is fetched once
+    assert sorted(request.url.path for request in requests) == ["/", "/a", "/b", "/c"]
+
+
+def test_unchanged_pages_are_answered_with_304(tmp_path):
+    cache = CrawlCache(str(tmp_path / "crawl.sqlite3"))
+    website = CrawlWebsite(url="http://site.test/", depth=2)
+    first = crawl(website, site_transport(), cache=cache, user_id="user")
+    assert all(page.changed for page in first)
+    for page in first:
+        cache.set("user", page.to_record())
+
+    requests = []
+    second = crawl(website, site_transport(requests), cache=cache, user_id="user")
+    assert all(request.headers["if-none-match"] for request in requests)
+    assert not any(page.changed for page in second)
+    # The links of the cached index still lead to the pages below it
+    assert sorted(page.url for page in second) == sorted(page.url for page in first)
+
+
+def test_a_site_redirected_to_another_host_is_crawled_there():
+    requests = []
+    site = site_transport(requests)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "old.test":
+            return httpx.Response(301, headers={"location": f"http://site.test{request.url.path}"})
+        return site.handler(request)
+
+    pages = crawl(CrawlWebsite(url="http://old.test/", depth=3), httpx.MockTransport(handler))
+    assert pages[0].url == "http://old.test/" and pages[0].final_url == "http://site.test/"
+    assert sorted(page.url for page in pages[1:]) == ["http://site.test/a", "http://site.test/b", "http://site.test/c"]
+    # The index is not fetched a second time through its new address
+    assert sorted(request.url.path for request in requests) == ["/", "/a", "/b", "/c"]
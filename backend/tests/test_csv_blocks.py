@@ -0,0 +1,38 @@
+import csv
+
+import pytest
+from parsers import csv_blocks
+
+
+@pytest.fixture(autouse=True)
+def encoding(monkeypatch, word_encoding):
+    monkeypatch.setattr(csv_blocks, "get_encoding", lambda: word_encoding)
+    return word_encoding
+
+
+def write_csv(path, header, rows):
+    with open(path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+    return str(path)
+
+
+def test_rows_are_grouped_under_the_header(tmp_path, encoding):
+    path = write_csv(tmp_path / "people.csv", ["name age"], [[f"person {index}"] for index in range(10)])
+    blocks = list(csv_blocks._iter_blocks(path, 8))
+    assert all(block.startswith("name age\n") for block in blocks)
+    assert all(len(encoding.encode(block)) <= 8 for block in blocks)
+    rows = [line for block in blocks for line in block.splitlines()[1:]]
+    assert rows == [f"person {index}" for index in range(10)]
+
+
+def test_a_header_over_the_budget_is_truncated(tmp_path, encoding):
+    header = [" ".join(f"column{index}" for index in range(100))]
+    path = write_csv(tmp_path / "wide.csv", header, [["a b c"]] * 5)
+    blocks = list(csv_blocks._iter_blocks(path, 20))
+    # The header keeps half of the budget, the other half holds 3 rows of 3 tokens
+    assert len(blocks) == 2
+    assert all(len(encoding.encode(block)) <= 20 for block in blocks)
+    assert all(block.startswith("column0 ") and "column10" not in block for block in blocks)
+    assert sum(block.count("a b c\n") for block in blocks) == 5
@@ -0,0 +1,58 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+from utils import embedding_cache
+from utils.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''A clock ticking once per call, so entries are used in a well defined order.'''
+    ticks = itertools.count()
+    monkeypatch.setattr(embedding_cache, "time", SimpleNamespace(time=lambda: float(next(ticks))))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(str(tmp_path / "embeddings.sqlite3"), max_entries=10)
+
+
+class CountingEmbeddings:
+    model = "test-embeddings"
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 0.5] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def test_embeddings_are_stored_per_model(cache):
+    cache.set_many("model-a", {"key": [0.25, -1.5]})
+    assert cache.get_many("model-a", ["key", "other"]) == {"key": [0.25, -1.5]}
+    assert cache.get_many("model-b", ["key"]) == {}
+    assert cache.stats() == {"hits": 1, "misses": 2, "hit_rate": 1 / 3}
+
+
+def test_least_recently_used_embeddings_are_evicted(cache, clock):
+    for index in range(10):
+        cache.set_many("model", {f"key{index}": [float(index)]})
+    cache.get_many("model", ["key0"])
+    cache.set_many("model", {"key10": [10.0]})
+    # Over the limit, a tenth of the cache goes at once: key1 and key2 were the least recently used
+    found = cache.get_many("model", [f"key{index}" for index in range(11)])
+    assert sorted(found) == sorted(f"key{index}" for index in (0, *range(3, 11)))
+
+
+def test_only_texts_not_cached_are_embedded(cache):
+    provider = CountingEmbeddings()
+    embeddings = CachedEmbeddings(provider, cache)
+    assert embeddings.embed_documents(["one", "three"]) == [[3.0, 0.5], [5.0, 0.5]]
+    assert embeddings.embed_documents(["three", "four"]) == [[5.0, 0.5], [4.0, 0.5]]
+    assert embeddings.embed_query("one") == [3.0, 0.5]
+    assert provider.embedded == ["one", "three", "four"]
@@ -0,0 +1,35 @@
+import asyncio
+import time
+from functools import partial
+
+import pytest
+from parsers import executor
+
+
+@pytest.fixture
+def single_process_pool(monkeypatch):
+    monkeypatch.setattr(executor, "parser_processes", 1)
+    monkeypatch.setattr(executor, "_executor", None)
+    yield
+    executor.shutdown_executor()
+
+
+def test_a_parse_over_the_timeout_is_stopped_in_its_process(single_process_pool):
+    async def run():
+        started = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await executor.run_in_pool(partial(time.sleep, 30), timeout=0.5)
+        # The only process of the pool is free again for the next file
+        assert await executor.run_in_pool(partial(sum, [1, 2]), timeout=10) == 3
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) < 20
+
+
+def test_time_limit_interrupts_the_block():
+    with pytest.raises(executor.TimeLimitExceeded):
+        with executor.time_limit(0.1):
+            while True:
+                pass
+    with executor.time_limit(1):
+        pass
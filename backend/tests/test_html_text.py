@@ -0,0 +1,26 @@
+from parsers.html_text import extract_text
+
+
+def test_scripts_styles_and_page_boilerplate_are_dropped():
+    html = ("<html><head><title>Title</title><style>p {}</style></head><body><header>Banner</header>"
+            "<nav>Menu</nav><p>Content</p><script>track()</script><footer>Footer</footer></body></html>")
+    assert extract_text(html) == "Content"
+
+
+def test_blocks_are_separate_lines():
+    assert extract_text("<div>One<br>Two</div><p>Three\n   four</p>") == "One\nTwo\nThree four"
+
+
+def test_webforms_pages_keep_their_content():
+    html = '<form id="aspnetForm"><div><p>Main content here</p></div></form>'
+    assert extract_text(html) == "Main content here"
+
+
+def test_article_headers_are_kept():
+    html = "<body><header>Banner</header><article><header><h1>Title</h1></header><p>Body</p></article></body>"
+    assert extract_text(html) == "Title\nBody"
+
+
+def test_an_unclosed_skipped_tag_ends_with_its_parent():
+    assert extract_text("<p>unclosed<nav>menu</p>after nav?") == "unclosed\nafter nav?"
+    assert extract_text("<div><aside>side</div>kept") == "kept"
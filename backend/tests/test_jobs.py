@@ -0,0 +1,80 @@
+import asyncio
+from collections import OrderedDict
+
+import pytest
+from utils import jobs
+
+
+@pytest.fixture(autouse=True)
+def job_registry(monkeypatch):
+    monkeypatch.setattr(jobs, "jobs", OrderedDict())
+    monkeypatch.setattr(jobs, "_queue", None)
+    monkeypatch.setattr(jobs, "_workers", [])
+    monkeypatch.setattr(jobs, "ingestion_workers", 1)
+
+
+def run_with_workers(scenario):
+    async def run():
+        jobs.start_workers()
+        try:
+            return await scenario()
+        finally:
+            await jobs.stop_workers()
+    return asyncio.run(run())
+
+
+def test_queued_and_running_jobs_are_pending_until_they_finish():
+    async def scenario():
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def work():
+            started.set()
+            await release.wait()
+            return {"message": "done", "type": "success"}
+
+        running = jobs.enqueue_job("user", "a.pdf", work, size=100)
+        queued = jobs.enqueue_job("user", "b.pdf", work, size=50)
+        jobs.enqueue_job("other user", "c.pdf", work, size=10)
+        await started.wait()
+        assert (running.status, queued.status) == ("running", "queued")
+        assert [(job.name, job.size) for job in jobs.get_pending_jobs("user")] == [("a.pdf", 100), ("b.pdf", 50)]
+
+        release.set()
+        await jobs._queue.join()
+        assert jobs.get_pending_jobs("user") == []
+        assert jobs.get_job(running.id).status == "done"
+
+    run_with_workers(scenario)
+
+
+def test_progress_is_reported_to_the_running_job():
+    async def scenario():
+        async def work():
+            jobs.report_progress(stage="embedding", bytes_processed=10, chunks_embedded=2)
+            jobs.report_progress(bytes_processed=5, chunks_deduplicated=1, pages_skipped=3)
+            return {"message": "a.pdf has been uploaded.", "type": "success"}
+
+        job = jobs.enqueue_job("user", "a.pdf", work)
+        await jobs._queue.join()
+        return job
+
+    job = run_with_workers(scenario)
+    assert (job.bytes_processed, job.chunks_embedded, job.chunks_deduplicated) == (15, 2, 1)
+    assert job.status == "done" and job.stage == "done"
+    # Skipped pages turn the success into a warning
+    assert job.result["type"] == "warning" and "3 pages" in job.result["message"]
+    # Outside of a job, progress goes nowhere
+    jobs.report_progress(bytes_processed=1)
+
+
+def test_a_job_that_raises_fails():
+    async def scenario():
+        async def work():
+            raise ValueError("unreadable")
+
+        job = jobs.enqueue_job("user", "a.pdf", work)
+        await jobs._queue.join()
+        return job
+
+    job = run_with_workers(scenario)
+    assert job.status == "failed" and "unreadable" in job.result["message"]
@@ -0,0 +1,49 @@
+import random
+
+from utils.minhash import MinHashIndex, _shingles, estimate_similarity, jaccard_similarity, minhash_signature
+
+VOCABULARY = [f"word{index}" for index in range(5000)]
+
+
+def random_words(generator, count=300):
+    return [generator.choice(VOCABULARY) for _ in range(count)]
+
+
+def test_identical_and_nearly_identical_texts_are_duplicates():
+    generator = random.Random(0)
+    words = random_words(generator)
+    index = MinHashIndex(0.9)
+    assert index.add_unless_duplicate(" ".join(words))
+    assert not index.add_unless_duplicate(" ".join(words))
+    words[150] = "changed"
+    assert not index.add_unless_duplicate(" ".join(words))
+
+
+def test_distinct_texts_sharing_most_words_are_kept():
+    # 12 words out of 300 changed: about 0.79 Jaccard similarity of the shingles, under the threshold
+    generator = random.Random(1)
+    dropped = 0
+    for _ in range(200):
+        words = random_words(generator)
+        other = list(words)
+        for position in generator.sample(range(len(words)), 12):
+            other[position] = generator.choice(VOCABULARY)
+        index = MinHashIndex(0.9)
+        index.add_unless_duplicate(" ".join(words))
+        dropped += not index.add_unless_duplicate(" ".join(other))
+    assert dropped == 0
+
+
+def test_signatures_estimate_the_similarity():
+    generator = random.Random(2)
+    words = random_words(generator)
+    assert estimate_similarity(minhash_signature(" ".join(words)), minhash_signature(" ".join(words))) == 1.0
+    unrelated = random_words(generator)
+    assert estimate_similarity(minhash_signature(" ".join(words)), minhash_signature(" ".join(unrelated))) < 0.1
+
+
+def test_shingles_are_kept_as_sorted_hashes():
+    shingles = _shingles("a b c d e", 3)
+    assert shingles.itemsize == 8 and list(shingles) == sorted(set(shingles)) and len(shingles) == 3
+    # a b c and b c d are shared, c d e and c d f are not
+    assert jaccard_similarity(shingles, _shingles("A b, c d f", 3)) == 0.5
@@ -0,0 +1,33 @@
+from utils.embedding_cache import QueryEmbeddingCache
+
+
+class RecordingEmbeddings:
+    def __init__(self):
+        self.texts = []
+
+    def embed_query(self, text):
+        self.texts.append(text)
+        return [float(len(self.texts))]
+
+
+def test_questions_differing_by_case_and_spacing_share_their_embedding():
+    embeddings = RecordingEmbeddings()
+    cache = QueryEmbeddingCache(max_entries=10, ttl=60)
+    assert cache.embed(embeddings, "What is  Quivr?") == [1.0]
+    assert cache.embed(embeddings, "what is quivr?") == [1.0]
+    # The model embeds the question as asked, the normalized one is only the key
+    assert embeddings.texts == ["What is  Quivr?"]
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_and_expired_questions_are_embedded_again():
+    embeddings = RecordingEmbeddings()
+    cache = QueryEmbeddingCache(max_entries=2, ttl=60)
+    for question in ("one", "two", "one", "three", "two"):
+        cache.embed(embeddings, question)
+    assert embeddings.texts == ["one", "two", "three", "two"]
+
+    expired = QueryEmbeddingCache(max_entries=2, ttl=0)
+    expired.embed(embeddings, "one")
+    expired.embed(embeddings, "one")
+    assert embeddings.texts[-2:] == ["one", "one"]
@@ -0,0 +1,82 @@
+import asyncio
+
+import openai
+import pytest
+from llm import summarization
+from parsers import common
+
+
+@pytest.fixture(autouse=True)
+def stored_summaries(monkeypatch):
+    '''Summaries are stored in memory by batches of 2, and each test gets its own concurrency limit.'''
+    batches = []
+
+    async def store_summaries(summaries, metadata):
+        batches.append((summaries, metadata))
+
+    monkeypatch.setattr(common, "store_summaries", store_summaries)
+    monkeypatch.setattr(common, "embedding_batch_size", 2)
+    monkeypatch.setattr(summarization, "_semaphore", None)
+    return batches
+
+
+async def stored_batches(chunks):
+    for start in range(0, len(chunks), 2):
+        yield chunks[start:start + 2]
+
+
+def summarize_chunks(chunks, summarize):
+    asyncio.run(common.summarize_chunks(stored_batches(chunks), {"file_name": "notes.txt"}, summarize=summarize))
+
+
+def test_every_chunk_is_summarized_and_stored_in_batches(stored_summaries):
+    chunks = [(str(index), f"chunk {index}") for index in range(5)]
+    summarize_chunks(chunks, lambda text: f"summary of {text}")
+    assert [len(summaries) for summaries, _ in stored_summaries] == [2, 2, 1]
+    assert sorted(summary for summaries, _ in stored_summaries for summary in summaries) == [
+        (str(index), f"summary of chunk {index}") for index in range(5)]
+    assert all(metadata == {"file_name": "notes.txt"} for _, metadata in stored_summaries)
+
+
+def test_a_chunk_that_fails_is_skipped(stored_summaries):
+    def summarize(text):
+        if text == "chunk 1":
+            raise ValueError("model unavailable")
+        return text.upper()
+
+    summarize_chunks([(str(index), f"chunk {index}") for index in range(3)], summarize)
+    assert sorted(summary for summaries, _ in stored_summaries for summary in summaries) == [
+        ("0", "CHUNK 0"), ("2", "CHUNK 2")]
+
+
+def test_rate_limited_calls_are_retried(monkeypatch, stored_summaries):
+    monkeypatch.setattr(summarization.random, "uniform", lambda low, high: 0)
+    attempts = []
+
+    def summarize(text):
+        attempts.append(text)
+        if len(attempts) < 3:
+            raise openai.error.RateLimitError("slow down")
+        return "summary"
+
+    summarize_chunks([("0", "chunk 0")], summarize)
+    assert len(attempts) == 3
+    assert stored_summaries[0][0] == [("0", "summary")]
+
+
+def test_rate_limits_of_the_api_reach_the_backoff(monkeypatch, stored_summaries):
+    monkeypatch.setattr(summarization.random, "uniform", lambda low, high: 0)
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        if len(calls) < 3:
+            raise openai.error.RateLimitError("slow down")
+        return {"choices": [{"message": {"role": "assistant", "content": "a summary"}}]}
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    summarize_chunks([("0", "a chunk summarized through the api")], summarization.llm_summerize)
+    assert len(calls) == 3
+    assert calls[0]["model"] == summarization.summary_model
+    assert "a chunk summarized through the api" in calls[0]["messages"][-1]["content"]
+    assert stored_summaries[0][0] == [("0", "a summary")]
@@ -0,0 +1,127 @@
+import math
+import operator
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+answer_cache_max_entries = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 5000))
+# A lookup compares the question with every answer of the user, this bounds its cost
+answer_cache_max_entries_per_user = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES_PER_USER", 200))
+# Cosine similarity from which a question is answered with the answer of a previous one
+answer_cache_threshold = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.97))
+# Seconds an answer is served from the cache, 0 keeps answers until they are evicted or invalidated
+answer_cache_ttl = float(os.environ.get("ANSWER_CACHE_TTL", 24 * 3600))
+
+
+@dataclass
+class CachedAnswer:
+    user_id: str
+    settings: Tuple
+    # Normalized, so the cosine similarity is a dot product. 4 bytes per float instead of a boxed Python float
+    embedding: Optional[array]
+    answer: str
+    created_at: float
+
+
+def _normalize(embedding: List[float]) -> Optional[array]:
+    norm = math.sqrt(sum(value * value for value in embedding))
+    return array("f", (value / norm for value in embedding)) if norm else None
+
+
+class AnswerCache:
+    '''An in-process cache of the answers of each user, served to a question whose embedding is close enough
+    to the one of a previous question asked with the same settings. Entries of a user are dropped when their
+    vectors change, the least recently used ones are evicted past `max_entries` overall or past
+    `max_entries_per_user` for their user. Lookups scan the entries of the user, run them in a thread.'''
+
+    def __init__(self, max_entries: int, threshold: float, ttl: float, max_entries_per_user: int = 200):
+        self.max_entries = max_entries
+        self.max_entries_per_user = max_entries_per_user
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        # Entry ids of each user, least recently used first
+        self._user_entries: Dict[str, "OrderedDict[int, None]"] = defaultdict(OrderedDict)
+        # Bumped on invalidation so answers computed against the previous vectors of a user are not stored
+        self._generations: Dict[str, int] = defaultdict(int)
+
+    def generation(self, user_id: str) -> int:
+        return self._generations[user_id]
+
+    def get(self, user_id: str, settings: Tuple, embedding: List[float]) -> Optional[str]:
+        vector = _normalize(embedding)
+        now = time.time()
+        with self._lock:
+            best_id, best_similarity = None, self.threshold
+            for entry_id in list(self._user_entries.get(user_id, ())):
+                entry = self._entries[entry_id]
+                if self.ttl and entry.created_at < now - self.ttl:
+                    self._remove(entry_id)
+                    continue
+                if entry.settings != settings or vector is None or entry.embedding is None:
+                    continue
+                similarity = sum(map(operator.mul, vector, entry.embedding))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self._user_entries[user_id].move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id].answer
+
+    def set(self, user_id: str, settings: Tuple, embedding: List[float], answer: str, generation: int):
+        with self._lock:
+            if generation != self._generations[user_id]:
+                return
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = CachedAnswer(user_id, settings, _normalize(embedding), answer, time.time())
+            user_entries = self._user_entries[user_id]
+            user_entries[entry_id] = None
+            while len(user_entries) > self.max_entries_per_user:
+                self._remove(next(iter(user_entries)))
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._generations[user_id] += 1
+            entry_ids = self._user_entries.pop(user_id, {})
+            for entry_id in entry_ids:
+                del self._entries[entry_id]
+        if entry_ids:
+            logger.info(f"Invalidated {len(entry_ids)} cached answers of user {user_id}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        user_entries = self._user_entries[entry.user_id]
+        user_entries.pop(entry_id, None)
+        if not user_entries:
+            del self._user_entries[entry.user_id]
+
+
+answer_cache = AnswerCache(answer_cache_max_entries, answer_cache_threshold, answer_cache_ttl,
+                           answer_cache_max_entries_per_user)
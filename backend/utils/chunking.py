@@ -0,0 +1,81 @@
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate
+from typing import List
+
+import tiktoken
+
+# This module is imported by the parser processes, keep its imports light.
+
+default_encoding = "cl100k_base"
+
+# Preferred split points, from the strongest boundary to the weakest
+_SEPARATORS = [b"\n\n", b"\n", b". ", b" "]
+# A split point is only used if the chunk keeps at least this share of the token budget
+_MIN_FILL = 0.5
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = default_encoding) -> tiktoken.Encoding:
+    '''Load each encoder once per process, building one takes longer than tokenizing a page.'''
+    return tiktoken.get_encoding(encoding_name)
+
+
+@lru_cache(maxsize=32)
+def get_chunker(chunk_size: int, chunk_overlap: int = 0, encoding_name: str = default_encoding) -> "TokenChunker":
+    return TokenChunker(chunk_size, chunk_overlap, get_encoding(encoding_name))
+
+
+class TokenChunker:
+    '''Split text into chunks of at most `chunk_size` tokens, overlapping by `chunk_overlap` tokens.
+
+    The text is tokenized once. Each chunk is cut at the last paragraph, line, sentence or word boundary of its
+    token window, found in the byte offsets of the tokens, so text is never tokenized again while searching for
+    a separator like RecursiveCharacterTextSplitter does.'''
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, encoding: tiktoken.Encoding):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"Chunk overlap ({chunk_overlap}) must be smaller than chunk size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.encoding = encoding
+
+    def split_text(self, text: str) -> List[str]:
+        data = text.encode("utf-8")
+        tokens = self.encoding.encode_ordinary(text)
+        # ends[i] is the byte offset where token i ends
+        ends = list(accumulate(len(self.encoding.decode_single_token_bytes(token)) for token in tokens))
+        chunks = []
+        start_token, start = 0, 0
+        while start_token < len(tokens):
+            end_token = min(start_token + self.chunk_size, len(tokens))
+            end = ends[end_token - 1]
+            if end_token < len(tokens):
+                end = self._split_point(data, start, end)
+            chunk = data[start:end].decode("utf-8", errors="ignore").strip()
+            if chunk:
+                chunks.append(chunk)
+            if end_token == len(tokens):
+                break
+            # First token starting at or after the split point, minus the overlap
+            next_token = bisect_right(ends, end)
+            start_token = max(start_token + 1, next_token - self.chunk_overlap)
+            start = _char_boundary(data, ends[start_token - 1])
+        return chunks
+
+    @staticmethod
+    def _split_point(data: bytes, start: int, end: int) -> int:
+        lowest = start + int((end - start) * _MIN_FILL)
+        for separator in _SEPARATORS:
+            position = data.rfind(separator, lowest, end)
+            if position != -1:
+                return position + len(separator)
+        # No boundary in the window, cut between two tokens
+        return _char_boundary(data, end)
+
+
+def _char_boundary(data: bytes, position: int) -> int:
+    '''Move back to the start of the UTF-8 character, a token may end in the middle of one.'''
+    while 0 < position < len(data) and data[position] & 0xC0 == 0x80:
+        position -= 1
+    return position
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Completions of summarization and evaluation. The chat models of the QA chain don't go through it, repeated
+# questions are served by utils/answer_cache.py instead.
+completion_cache_path = os.environ.get("COMPLETION_CACHE_PATH", "completion_cache.sqlite3")
+completion_cache_max_entries = int(os.environ.get("COMPLETION_CACHE_MAX_ENTRIES", 20000))
+# Seconds a completion is served from the cache, 0 keeps completions until they are evicted
+completion_cache_ttl = float(os.environ.get("COMPLETION_CACHE_TTL", 7 * 24 * 3600))
+
+
+def completion_key(prompt: str, **params) -> str:
+    '''Key of a completion: sha256 of the prompt and of the sampling parameters.'''
+    return hashlib.sha256(json.dumps([prompt, params], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    '''A persistent LLM completion cache keyed by (model, completion_key), entries expire after `ttl` seconds
+    and the least recently used ones are evicted past `max_entries`.'''
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "model TEXT, key TEXT, completion TEXT, created_at REAL, last_used REAL, PRIMARY KEY (model, key))")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+        self._connection.commit()
+
+    def get(self, model: str, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT completion, created_at FROM completions WHERE model = ? AND key = ?", (model, key)).fetchone()
+            if row is not None and self.ttl and row[1] < now - self.ttl:
+                self._connection.execute("DELETE FROM completions WHERE model = ? AND key = ?", (model, key))
+                self._connection.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute(
+                "UPDATE completions SET last_used = ? WHERE model = ? AND key = ?", (now, model, key))
+            self._connection.commit()
+            self.hits += 1
+        return row[0]
+
+    def set(self, model: str, key: str, completion: str):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completions (model, key, completion, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)", (model, key, completion, now, now))
+            self._evict(now)
+            self._connection.commit()
+
+    def clear(self, model: Optional[str] = None):
+        with self._lock:
+            if model is None:
+                self._connection.execute("DELETE FROM completions")
+            else:
+                self._connection.execute("DELETE FROM completions WHERE model = ?", (model,))
+            self._connection.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _evict(self, now: float):
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM completions").fetchone()
+        if count <= self.max_entries:
+            return
+        expired = 0
+        if self.ttl:
+            expired = self._connection.execute(
+                "DELETE FROM completions WHERE created_at < ?", (now - self.ttl,)).rowcount
+        # Evict a tenth of the cache at once so we don't pay for a delete on every insert
+        excess = count - expired - self.max_entries + self.max_entries // 10
+        if excess > 0:
+            self._connection.execute(
+                "DELETE FROM completions WHERE rowid IN (SELECT rowid FROM completions ORDER BY last_used LIMIT ?)",
+                (excess,))
+        logger.info(f"Evicted {expired} expired and {max(0, excess)} least recently used completions from the cache")
+
+completion_cache = CompletionCache(completion_cache_path, completion_cache_max_entries, completion_cache_ttl)
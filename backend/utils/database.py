@@ -0,0 +1,67 @@
+import asyncio
+import inspect
+import os
+from typing import Dict, Optional, Union
+
+import httpx
+from postgrest import APIResponse, AsyncPostgrestClient
+
+supabase_url = os.environ.get("SUPABASE_URL")
+supabase_key = os.environ.get("SUPABASE_SERVICE_KEY")
+# Queries in flight across the whole process, the others wait for a slot
+database_concurrency = int(os.environ.get("DATABASE_CONCURRENCY", 20))
+database_max_connections = int(os.environ.get("DATABASE_MAX_CONNECTIONS", 10))
+database_timeout = float(os.environ.get("DATABASE_TIMEOUT", 10))
+
+_database: Optional["PooledPostgrestClient"] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+class PooledPostgrestClient(AsyncPostgrestClient):
+    '''Async PostgREST client multiplexing its queries over a small pool of HTTP/2 connections.'''
+
+    def create_session(self, base_url: str, headers: Dict[str, str], timeout: Union[int, float, httpx.Timeout]):
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            http2=True,
+            limits=httpx.Limits(max_connections=database_max_connections,
+                                max_keepalive_connections=database_max_connections),
+        )
+
+
+def get_database() -> PooledPostgrestClient:
+    '''The async client shared by the endpoints, built with the same credentials as the supabase client.'''
+    global _database
+    if _database is None:
+        _database = PooledPostgrestClient(
+            f"{supabase_url}/rest/v1",
+            headers={"apiKey": supabase_key, "Authorization": f"Bearer {supabase_key}"},
+            timeout=database_timeout,
+        )
+    return _database
+
+
+async def close_database():
+    global _database
+    if _database is not None:
+        await _database.aclose()
+        _database = None
+
+
+async def execute(query) -> APIResponse:
+    '''Execute a query of the async client within the concurrency limit of the process.'''
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(database_concurrency)
+    async with _semaphore:
+        return await query.execute()
+
+
+async def rpc(function: str, params: dict) -> APIResponse:
+    query = get_database().rpc(function, params)
+    # Older postgrest releases build RPC queries in a coroutine
+    if inspect.isawaitable(query):
+        query = await query
+    return await execute(query)
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from langchain.embeddings.base import Embeddings
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+embedding_cache_path = os.environ.get("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+embedding_cache_max_entries = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 50000))
+query_embedding_cache_size = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 2048))
+query_embedding_cache_ttl = float(os.environ.get("QUERY_EMBEDDING_CACHE_TTL", 3600))
+
+# SQLite limits the number of bound parameters of a single statement
+_SQLITE_BATCH_SIZE = 500
+
+
+def compute_sha256_from_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    '''A persistent embedding cache keyed by (model, sha256 of the text), evicting the least recently used entries.'''
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT, key TEXT, embedding BLOB, last_used REAL, PRIMARY KEY (model, key))")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._connection.commit()
+
+    def get_many(self, model: str, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _SQLITE_BATCH_SIZE):
+                batch = keys[start:start + _SQLITE_BATCH_SIZE]
+                rows = self._connection.execute(
+                    f"SELECT key, embedding FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(batch))})",
+                    [model, *batch]).fetchall()
+                found.update((key, array("f", blob).tolist()) for key, blob in rows)
+            if found:
+                now = time.time()
+                self._connection.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND key = ?",
+                    [(now, model, key) for key in found])
+                self._connection.commit()
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def set_many(self, model: str, embeddings: Dict[str, List[float]]):
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, key, embedding, last_used) VALUES (?, ?, ?, ?)",
+                [(model, key, array("f", embedding).tobytes(), now) for key, embedding in embeddings.items()])
+            self._evict()
+            self._connection.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _evict(self):
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count <= self.max_entries:
+            return
+        # Evict a tenth of the cache at once so we don't pay for a delete on every insert
+        excess = count - self.max_entries + self.max_entries // 10
+        self._connection.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,))
+        logger.info(f"Evicted {excess} embeddings from the cache")
+
+
+class CachedEmbeddings(Embeddings):
+    '''Wraps an embeddings provider so that texts already embedded are served from the cache.'''
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model: Optional[str] = None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model or getattr(embeddings, "model", type(embeddings).__name__)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [compute_sha256_from_text(text) for text in texts]
+        found = self.cache.get_many(self.model, keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+            self.cache.set_many(self.model, computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = compute_sha256_from_text(text)
+        found = self.cache.get_many(self.model, [key])
+        if key not in found:
+            found[key] = self.embeddings.embed_query(text)
+            self.cache.set_many(self.model, found)
+        return found[key]
+
+
+def normalize_question(question: str) -> str:
+    '''Questions differing only by case, unicode form or spacing share their embedding.'''
+    return " ".join(unicodedata.normalize("NFKC", question).casefold().split())
+
+
+class QueryEmbeddingCache:
+    '''An in-process LRU cache of the embeddings of the questions, entries expire after `ttl` seconds.'''
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+
+    def embed(self, embeddings: Embeddings, question: str) -> List[float]:
+        key = normalize_question(question)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # The normalized question is only the key, the model embeds what the user asked
+        embedding = embeddings.embed_query(question)
+        with self._lock:
+            self._entries[key] = (now, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return embedding
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+embedding_cache = EmbeddingCache(embedding_cache_path, embedding_cache_max_entries)
+query_embedding_cache = QueryEmbeddingCache(query_embedding_cache_size, query_embedding_cache_ttl)
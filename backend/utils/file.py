@@ -1,6 +1,12 @@
 import hashlib
+import os
+import tempfile
 
 from fastapi import UploadFile
+from pydantic import BaseModel
+
+# Uploads are streamed to disk in blocks of this size so memory stays flat whatever the file size
+SPOOL_BLOCK_SIZE = 1024 * 1024
 
 
 def convert_bytes(bytes, precision=2):
@@ -15,23 +21,44 @@ def convert_bytes(bytes, precision=2):
         index += 1
     return f'{size:.{precision}f} {abbreviations[index]}'
 
-def get_file_size(file: UploadFile):
-    # move the cursor to the end of the file
-    file.file._file.seek(0, 2)
-    file_size = file.file._file.tell()  # Getting the size of the file
-    # move the cursor back to the beginning of the file 
-    file.file.seek(0)
+class IngestHandle(BaseModel):
+    '''A file spooled to disk once, shared by the dedup check, the size quota and the parsers.'''
+    path: str
+    filename: str
+    sha1: str
+    size: int
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+async def spool_upload(file: UploadFile, block_size: int = SPOOL_BLOCK_SIZE) -> IngestHandle:
+    '''Write the upload to a temporary file in a single pass, hashing and counting bytes along the way.'''
+    sha1 = hashlib.sha1()
+    size = 0
+    await file.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=file.filename) as tmp_file:
+        while block := await file.read(block_size):
+            tmp_file.write(block)
+            sha1.update(block)
+            size += len(block)
+    return IngestHandle(path=tmp_file.name, filename=file.filename, sha1=sha1.hexdigest(), size=size)
 
-    return file_size
 
+def ingest_handle_from_path(file_path, filename) -> IngestHandle:
+    return IngestHandle(path=file_path, filename=filename,
+                        sha1=compute_sha1_from_file(file_path), size=os.path.getsize(file_path))
 
-def compute_sha1_from_file(file_path):
+
+def compute_sha1_from_file(file_path, block_size: int = SPOOL_BLOCK_SIZE):
+    sha1 = hashlib.sha1()
     with open(file_path, "rb") as file:
-        bytes = file.read()
-        readable_hash = compute_sha1_from_content(bytes)
-    return readable_hash
+        while block := file.read(block_size):
+            sha1.update(block)
+    return sha1.hexdigest()
 
 
 def compute_sha1_from_content(content):
     readable_hash = hashlib.sha1(content).hexdigest()
-    return readable_hash
\ No newline at end of file
+    return readable_hash
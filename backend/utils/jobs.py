@@ -0,0 +1,108 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Awaitable, Callable, List, Optional
+
+from logger import get_logger
+from models.jobs import IngestionJob
+
+logger = get_logger(__name__)
+
+ingestion_workers = int(os.environ.get("INGESTION_WORKERS", 2))
+ingestion_queue_size = int(os.environ.get("INGESTION_QUEUE_SIZE", 100))
+# Finished jobs are kept around so their status can still be fetched, oldest ones are dropped first
+ingestion_jobs_retention = int(os.environ.get("INGESTION_JOBS_RETENTION", 1000))
+
+jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+current_job: ContextVar[Optional[IngestionJob]] = ContextVar("current_job", default=None)
+
+_queue: Optional[asyncio.Queue] = None
+_workers: List[asyncio.Task] = []
+
+
+class IngestionQueueFull(Exception):
+    pass
+
+
+def start_workers():
+    '''Start the pool of workers draining the ingestion queue. Must be called from the running event loop.'''
+    global _queue
+    _queue = asyncio.Queue(maxsize=ingestion_queue_size)
+    for index in range(ingestion_workers):
+        _workers.append(asyncio.create_task(_worker(index)))
+    logger.info(f"Started {ingestion_workers} ingestion workers")
+
+
+async def stop_workers():
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+def enqueue_job(user_id: str, name: str, work: Callable[[], Awaitable[dict]], size: int = 0) -> IngestionJob:
+    '''Queue the ingestion coroutine factory `work` and return the job tracking it.'''
+    job = IngestionJob(id=str(uuid.uuid4()), user_id=user_id, name=name, size=size)
+    try:
+        _queue.put_nowait((job, work))
+    except asyncio.QueueFull:
+        raise IngestionQueueFull(f"Ingestion queue is full ({ingestion_queue_size} jobs)")
+    jobs[job.id] = job
+    _evict_finished_jobs()
+    return job
+
+
+def get_job(job_id: str) -> Optional[IngestionJob]:
+    return jobs.get(job_id)
+
+
+def get_pending_jobs(user_id: str) -> List[IngestionJob]:
+    '''Queued and running jobs of the user.'''
+    return [job for job in jobs.values() if job.user_id == user_id and job.status in ("queued", "running")]
+
+
+def report_progress(stage: Optional[str] = None, bytes_processed: int = 0, chunks_embedded: int = 0,
+                    chunks_deduplicated: int = 0, pages_skipped: int = 0):
+    '''Update the job running in the current context, if any. Counters are incremented.'''
+    job = current_job.get()
+    if job is None:
+        return
+    if stage:
+        job.stage = stage
+    job.bytes_processed += bytes_processed
+    job.chunks_embedded += chunks_embedded
+    job.chunks_deduplicated += chunks_deduplicated
+    job.pages_skipped += pages_skipped
+    job.updated_at = time.time()
+
+
+async def _worker(index: int):
+    while True:
+        job, work = await _queue.get()
+        token = current_job.set(job)
+        job.status = "running"
+        report_progress(stage="starting")
+        try:
+            job.result = await work()
+            if job.pages_skipped and job.result.get("type") == "success":
+                job.result = {"message": f"{job.result['message']} {job.pages_skipped} pages could not be read "
+                                         "in time and were skipped.", "type": "warning"}
+            job.status = "failed" if job.result.get("type") == "error" else "done"
+        except Exception as e:
+            logger.exception(f"Ingestion job {job.id} ({job.name}) failed")
+            job.result = {"message": f"❌ {job.name} could not be processed: {e}", "type": "error"}
+            job.status = "failed"
+        finally:
+            report_progress(stage=job.status)
+            current_job.reset(token)
+            _queue.task_done()
+        logger.info(f"Worker {index} finished job {job.id} ({job.name}) with status {job.status}")
+
+
+def _evict_finished_jobs():
+    finished = [job_id for job_id, job in jobs.items() if job.status in ("done", "failed")]
+    for job_id in finished[:max(0, len(jobs) - ingestion_jobs_retention)]:
+        del jobs[job_id]
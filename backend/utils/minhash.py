@@ -0,0 +1,79 @@
+import hashlib
+import re
+from array import array
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# Signatures are computed with one permutation hashing: every shingle is hashed once and only the minimum hash of
+# each bin is kept, which estimates the Jaccard similarity of the shingle sets like a classic MinHash of num_bins
+# permutations at the cost of a single one.
+_EMPTY_BIN = 1 << 64
+
+
+def _shingles(text: str, size: int) -> array:
+    '''Sorted distinct 64-bit hashes of the shingles of the text, 8 bytes each where the strings take about 70.'''
+    words = re.sub(r"\W+", " ", text.lower()).split()
+    if len(words) <= size:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return array("Q", sorted(
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        for shingle in shingles))
+
+
+def minhash_signature(text: str, num_bins: int = 128, shingle_size: int = 3) -> Tuple[int, ...]:
+    return _signature(_shingles(text, shingle_size), num_bins)
+
+
+def _signature(shingles: array, num_bins: int) -> Tuple[int, ...]:
+    signature = [_EMPTY_BIN] * num_bins
+    for value in shingles:
+        index = value % num_bins
+        if value < signature[index]:
+            signature[index] = value
+    return tuple(signature)
+
+
+def estimate_similarity(signature: Tuple[int, ...], other: Tuple[int, ...]) -> float:
+    '''Estimated Jaccard similarity of the shingles of two texts, bins empty in both are not counted.'''
+    filled = [(a, b) for a, b in zip(signature, other) if a != _EMPTY_BIN or b != _EMPTY_BIN]
+    if not filled:
+        return 1.0
+    return sum(a == b for a, b in filled) / len(filled)
+
+
+def jaccard_similarity(shingles: array, other: array) -> float:
+    '''Jaccard similarity of two arrays of distinct shingle hashes.'''
+    if not shingles and not other:
+        return 1.0
+    common = len(set(shingles).intersection(other))
+    return common / (len(shingles) + len(other) - common)
+
+
+class MinHashIndex:
+    '''Find the texts that are near duplicates of a text already added, with locality sensitive hashing:
+    signatures are cut into bands and only texts sharing a band are candidates. A dropped chunk is lost content,
+    so candidates are confirmed with the exact Jaccard similarity of their shingles, the signatures only find them.'''
+
+    def __init__(self, threshold: float = 0.9, num_bins: int = 128, bands: int = 16, shingle_size: int = 3):
+        self.threshold = threshold
+        self.num_bins = num_bins
+        self.rows = num_bins // bands
+        self.shingle_size = shingle_size
+        self._shingles: List[array] = []
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = defaultdict(list)
+
+    def add_unless_duplicate(self, text: str) -> bool:
+        '''Add the text and return True, or return False without adding it if it's a near duplicate.'''
+        shingles = _shingles(text, self.shingle_size)
+        signature = _signature(shingles, self.num_bins)
+        keys = [(band, signature[start:start + self.rows])
+                for band, start in enumerate(range(0, self.num_bins, self.rows))]
+        candidates = {index for key in keys for index in self._buckets.get(key, ())}
+        if any(jaccard_similarity(shingles, self._shingles[index]) >= self.threshold for index in candidates):
+            return False
+        for key in keys:
+            self._buckets[key].append(len(self._shingles))
+        self._shingles.append(shingles)
+        return True
@@ -0,0 +1,84 @@
+import asyncio
+import hashlib
+import os
+from typing import AsyncIterable, AsyncIterator, List, TypeVar
+
+from logger import get_logger
+from utils.jobs import report_progress
+from utils.minhash import MinHashIndex
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# Number of items a stage can get ahead of the stage consuming it
+pipeline_queue_size = int(os.environ.get("PIPELINE_QUEUE_SIZE", 200))
+# Estimated similarity above which a chunk is a near duplicate of one already seen, 1 only drops exact duplicates
+near_duplicate_threshold = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", 0.9))
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+async def bounded(source: AsyncIterable[T], maxsize: int = pipeline_queue_size) -> AsyncIterator[T]:
+    '''Run `source` in its own task, buffering at most `maxsize` items so a slow consumer pushes back on it.'''
+    queue: asyncio.Queue = asyncio.Queue(maxsize)
+
+    async def produce():
+        try:
+            async for item in source:
+                await queue.put(item)
+            await queue.put(_DONE)
+        except Exception as e:
+            await queue.put(_Failure(e))
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (item := await queue.get()) is not _DONE:
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        producer.cancel()
+
+
+async def batched(source: AsyncIterable[T], size: int) -> AsyncIterator[List[T]]:
+    batch = []
+    async for item in source:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def dedup(source: AsyncIterable[str], threshold: float = near_duplicate_threshold) -> AsyncIterator[str]:
+    '''Drop chunks whose exact text was already seen in this stream, and the near duplicates of a chunk already
+    seen, like repeated headers, footers and disclaimers. The number of chunks dropped is reported to the job.'''
+    seen = set()
+    near_duplicates = MinHashIndex(threshold) if threshold < 1 else None
+    exact, near = 0, 0
+    async for text in source:
+        key = hashlib.sha1(text.encode("utf-8")).digest()
+        if key in seen:
+            exact += 1
+            report_progress(chunks_deduplicated=1)
+            continue
+        seen.add(key)
+        if near_duplicates and not near_duplicates.add_unless_duplicate(text):
+            near += 1
+            report_progress(chunks_deduplicated=1)
+            continue
+        yield text
+    if exact or near:
+        logger.info(f"Dropped {exact} duplicate and {near} near duplicate chunks")
+
+
+async def iterate(items) -> AsyncIterator:
+    for item in items:
+        yield item
@@ -1,20 +1,24 @@
 import os
 
-from fastapi import Depends, FastAPI, UploadFile
+from crawl.cache import crawl_cache
+from crawl.crawler import CrawlWebsite
+from models.ingestion import IngestionOptions
 from models.users import User
 from parsers.audio import process_audio
 from parsers.common import file_already_exists
 from parsers.csv import process_csv
 from parsers.docx import process_docx
 from parsers.epub import process_epub
-from parsers.html import process_html
+from parsers.html import process_html, process_html_page
 from parsers.markdown import process_markdown
 from parsers.notebook import process_ipnyb
 from parsers.odt import process_odt
 from parsers.pdf import process_pdf
 from parsers.powerpoint import process_powerpoint
 from parsers.txt import process_txt
-from supabase import Client
+from postgrest import AsyncPostgrestClient
+from utils.file import IngestHandle
+from utils.pipeline import bounded
 
 file_processors = {
     ".txt": process_txt,
@@ -40,16 +44,38 @@ file_processors = {
 
 
 
-async def filter_file(file: UploadFile, enable_summarization: bool, supabase_client: Client, user: User):
-    if await file_already_exists(supabase_client, file, user):
-        return {"message": f"🤔 {file.filename} already exists.", "type": "warning"}
-    elif file.file._file.tell()  < 1:
-        return {"message": f"❌ {file.filename} is empty.", "type": "error"}
-    else:
-        file_extension = os.path.splitext(file.filename)[-1].lower()  # Convert file extension to lowercase
-        if file_extension in file_processors:
-            await file_processors[file_extension](file, enable_summarization, user)
-            return {"message": f"✅ {file.filename} has been uploaded.", "type": "success"}
+async def filter_file(file: IngestHandle, enable_summarization: bool, database: AsyncPostgrestClient, user: User,
+                      options: IngestionOptions):
+    try:
+        if await file_already_exists(database, file.sha1, user):
+            return {"message": f"🤔 {file.filename} already exists.", "type": "warning"}
+        elif file.size < 1:
+            return {"message": f"❌ {file.filename} is empty.", "type": "error"}
         else:
-            return {"message": f"❌ {file.filename} is not supported.", "type": "error"}
+            file_extension = os.path.splitext(file.filename)[-1].lower()  # Convert file extension to lowercase
+            if file_extension in file_processors:
+                await file_processors[file_extension](file, enable_summarization, user, options)
+                if options.versioned:
+                    return {"message": f"✅ {file.filename} has been updated.", "type": "success"}
+                return {"message": f"✅ {file.filename} has been uploaded.", "type": "success"}
+            else:
+                return {"message": f"❌ {file.filename} is not supported.", "type": "error"}
+    finally:
+        file.remove()
 
+
+async def filter_crawl(crawl_website: CrawlWebsite, enable_summarization: bool, database: AsyncPostgrestClient,
+                       user: User, options: IngestionOptions):
+    '''Ingest the pages of the crawl as they arrive, the crawler keeps fetching while pages are being embedded.
+    Pages that didn't change since they were last ingested are skipped.'''
+    crawled, uploaded = 0, 0
+    pages = crawl_website.crawl(cache=crawl_cache, user_id=user.email)
+    async for page in bounded(pages, maxsize=crawl_website.max_pages):
+        crawled += 1
+        if page.changed and not await file_already_exists(database, page.content_sha1, user):
+            await process_html_page(page.url, page.html, page.content_sha1, enable_summarization, user, options)
+            uploaded += 1
+        crawl_cache.set(user.email, page.to_record())
+    if not crawled:
+        return {"message": f"❌ {crawl_website.url} could not be crawled.", "type": "error"}
+    return {"message": f"✅ {crawl_website.url} has been crawled, {uploaded} of {crawled} pages uploaded.", "type": "success"}
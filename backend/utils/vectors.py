@@ -1,14 +1,22 @@
+import asyncio
 import os
-from typing import Annotated, List, Tuple
+import time
+from collections import defaultdict
+from typing import Annotated, Dict, Iterator, List, Tuple
 
 from fastapi import Depends, UploadFile
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.schema import Document
 from langchain.vectorstores import SupabaseVectorStore
-from llm.summarization import llm_summerize
 from logger import get_logger
 from pydantic import BaseModel
 from supabase import Client, create_client
+from utils.embedding_cache import (CachedEmbeddings, embedding_cache,
+                                   query_embedding_cache)
+from utils.database import execute, get_database, rpc
+from utils.file import compute_sha1_from_content
+from utils.jobs import report_progress
+from utils.postgres import copy_summaries, copy_vectors, direct_postgres
 
 logger = get_logger(__name__)
 
@@ -17,12 +25,25 @@ openai_api_key = os.environ.get("OPENAI_API_KEY")
 anthropic_api_key = os.environ.get("ANTHROPIC_API_KEY")
 supabase_url = os.environ.get("SUPABASE_URL")
 supabase_key = os.environ.get("SUPABASE_SERVICE_KEY")
-embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
+embeddings = CachedEmbeddings(
+    OpenAIEmbeddings(openai_api_key=openai_api_key), embedding_cache)
 supabase_client: Client = create_client(supabase_url, supabase_key)
 documents_vector_store = SupabaseVectorStore(
     supabase_client, embeddings, table_name="vectors")
 summaries_vector_store = SupabaseVectorStore(
     supabase_client, embeddings, table_name="summaries")
+embedding_batch_size = int(os.environ.get("EMBEDDING_BATCH_SIZE", 100))
+# Ids are sent in the query string when filtering with in_, keep the url short
+ids_batch_size = 200
+# PostgREST caps the rows of a response, 1000 by default on Supabase, larger selects are fetched in pages
+select_page_size = 1000
+# "shared" stores every chunk once in a content addressed table the users reference,
+# see scripts/supabase_shared_chunks.sql
+shared_storage = os.environ.get("VECTOR_STORAGE_MODE", "per_user") == "shared"
+# Table of the chunks of the users, with their user_id and metadata
+vectors_table = "user_chunks" if shared_storage else "vectors"
+# Same rows with the content of the chunks
+vectors_content_table = "user_chunks_with_content" if shared_storage else "vectors"
 
 
 
@@ -31,6 +52,7 @@ summaries_vector_store = SupabaseVectorStore(
 def common_dependencies():
     return {
         "supabase": supabase_client,
+        "database": get_database(),
         "embeddings": embeddings,
         "documents_vector_store": documents_vector_store,
         "summaries_vector_store": summaries_vector_store
@@ -42,50 +64,202 @@ CommonsDep = Annotated[dict, Depends(common_dependencies)]
 
 
 
-def create_summary(document_id, content, metadata):
-    logger.info(f"Summarizing document {content[:100]}")
-    summary = llm_summerize(content)
-    logger.info(f"Summary: {summary}")
-    metadata['document_id'] = document_id
-    summary_doc_with_metadata = Document(
-        page_content=summary, metadata=metadata)
-    sids = summaries_vector_store.add_documents(
-        [summary_doc_with_metadata])
-    if sids and len(sids) > 0:
-        supabase_client.table("summaries").update(
-            {"document_id": document_id}).match({"id": sids[0]}).execute()
+async def store_summaries(summaries: List[Tuple[str, str]], metadata):
+    '''Store the summaries of a batch, with binary COPY when a direct Postgres connection is configured.'''
+    if not direct_postgres:
+        return await asyncio.to_thread(create_summaries, summaries, metadata)
+    started_at = time.perf_counter()
+    summary_embeddings = await asyncio.to_thread(embeddings.embed_documents, [summary for _, summary in summaries])
+    await copy_summaries([
+        (document_id, summary, {**metadata, "document_id": document_id}, embedding)
+        for (document_id, summary), embedding in zip(summaries, summary_embeddings)
+    ])
+    logger.info(f"Batch of {len(summaries)} summaries copied in {time.perf_counter() - started_at:.2f}s")
 
-def create_vector(user_id,doc):
-    logger.info(f"Creating vector for document")
-    logger.info(f"Document: {doc}")
-    sids = documents_vector_store.add_documents(
-        [doc])
-    if sids and len(sids) > 0:
-        supabase_client.table("vectors").update(
-            {"user_id": user_id}).match({"id": sids[0]}).execute()
+def create_summaries(summaries: List[Tuple[str, str]], metadata):
+    '''Embed and bulk insert the summaries, given as (document_id, summary) pairs, linked to their chunks.'''
+    started_at = time.perf_counter()
+    summary_embeddings = embeddings.embed_documents([summary for _, summary in summaries])
+    rows = [
+        {
+            "document_id": document_id,
+            "content": summary,
+            "metadata": {**metadata, "document_id": document_id},
+            "embedding": embedding,
+        }
+        for (document_id, summary), embedding in zip(summaries, summary_embeddings)
+    ]
+    supabase_client.table("summaries").insert(rows).execute()
+    logger.info(f"Batch of {len(summaries)} summaries stored in {time.perf_counter() - started_at:.2f}s")
 
-def create_user(user_id, date):
+async def store_vectors(user_id, docs: List[Document]) -> List[str]:
+    '''Embed and store a batch of documents, with binary COPY when a direct Postgres connection is configured.
+    Shared storage needs upserts COPY can't do and always goes through PostgREST.'''
+    if not direct_postgres or shared_storage:
+        return await asyncio.to_thread(create_vectors, user_id, docs)
+    started_at = time.perf_counter()
+    batch_embeddings = await asyncio.to_thread(embeddings.embed_documents, [doc.page_content for doc in docs])
+    embedded_at = time.perf_counter()
+    ids = await copy_vectors([
+        (user_id, doc.page_content, _with_chunk_sha1(doc), embedding)
+        for doc, embedding in zip(docs, batch_embeddings)
+    ])
+    report_progress(chunks_embedded=len(docs))
+    logger.info(
+        f"Batch of {len(docs)} vectors: embedding {embedded_at - started_at:.2f}s, "
+        f"copy {time.perf_counter() - embedded_at:.2f}s")
+    return ids
+
+def create_vectors(user_id, docs: List[Document], batch_size: int = embedding_batch_size) -> List[str]:
+    '''Embed the documents in batches and bulk insert them with the user_id already set.'''
+    insert_batch = _insert_shared_batch if shared_storage else _insert_batch
+    ids = []
+    for start in range(0, len(docs), batch_size):
+        batch = docs[start:start + batch_size]
+        ids.extend(insert_batch(user_id, batch))
+        report_progress(chunks_embedded=len(batch))
+    return ids
+
+def _insert_batch(user_id, batch: List[Document]) -> List[str]:
+    started_at = time.perf_counter()
+    batch_embeddings = embeddings.embed_documents(
+        [doc.page_content for doc in batch])
+    embedded_at = time.perf_counter()
+    rows = [
+        {
+            "user_id": user_id,
+            "content": doc.page_content,
+            "metadata": _with_chunk_sha1(doc),
+            "embedding": embedding,
+        }
+        for doc, embedding in zip(batch, batch_embeddings)
+    ]
+    response = supabase_client.table("vectors").insert(rows).execute()
+    logger.info(
+        f"Batch of {len(batch)} vectors: embedding {embedded_at - started_at:.2f}s, "
+        f"insert {time.perf_counter() - embedded_at:.2f}s")
+    return [str(row["id"]) for row in response.data]
+
+def _insert_shared_batch(user_id, batch: List[Document]) -> List[str]:
+    '''Reference the chunks already stored by any user and only embed and store the others.'''
+    started_at = time.perf_counter()
+    sha1s = [compute_sha1_from_content(doc.page_content.encode("utf-8")) for doc in batch]
+    contents = dict(zip(sha1s, (doc.page_content for doc in batch)))
+    stored = set()
+    for sha1_batch in _batches(list(contents)):
+        response = supabase_client.table("chunks").select("sha1").in_("sha1", sha1_batch).execute()
+        stored.update(row["sha1"] for row in response.data)
+    missing = [sha1 for sha1 in contents if sha1 not in stored]
+    if missing:
+        missing_embeddings = embeddings.embed_documents([contents[sha1] for sha1 in missing])
+        rows = [
+            {"sha1": sha1, "content": contents[sha1], "embedding": embedding}
+            for sha1, embedding in zip(missing, missing_embeddings)
+        ]
+        # Another user may have stored the same chunk in the meantime
+        supabase_client.table("chunks").upsert(rows, ignore_duplicates=True).execute()
+    embedded_at = time.perf_counter()
+    references = [
+        {"user_id": user_id, "chunk_sha1": sha1, "metadata": doc.metadata}
+        for sha1, doc in zip(sha1s, batch)
+    ]
+    response = supabase_client.table("user_chunks").insert(references).execute()
+    logger.info(
+        f"Batch of {len(batch)} chunks, {len(missing)} new: embedding {embedded_at - started_at:.2f}s, "
+        f"insert {time.perf_counter() - embedded_at:.2f}s")
+    return [str(row["id"]) for row in response.data]
+
+def _with_chunk_sha1(doc: Document) -> dict:
+    # Per-user vectors carry the sha1 of their content so a new version of the file finds them without the content
+    return {**doc.metadata, "chunk_sha1": compute_sha1_from_content(doc.page_content.encode("utf-8"))}
+
+def _select_all(query) -> List[dict]:
+    '''All the rows of the select built by `query()`, ordered by id and fetched page by page.'''
+    rows = []
+    while True:
+        response = query().order("id").range(len(rows), len(rows) + select_page_size).execute()
+        rows.extend(response.data)
+        if len(response.data) < select_page_size:
+            return rows
+
+def get_chunk_ids(user_id, file_name) -> Dict[str, List[str]]:
+    '''Ids of the stored chunks of a file, grouped by the sha1 of their content.'''
+    if shared_storage:
+        rows = _select_all(lambda: supabase_client.table("user_chunks").select("id, chunk_sha1")
+                           .filter("user_id", "eq", user_id).filter("metadata->>file_name", "eq", file_name))
+    else:
+        rows = _select_all(lambda: supabase_client.table("vectors").select("id, chunk_sha1:metadata->>chunk_sha1")
+                           .filter("user_id", "eq", user_id).filter("metadata->>file_name", "eq", file_name))
+        # Vectors stored before chunk_sha1 was added to the metadata are hashed from their content
+        legacy = {row["id"]: row for row in rows if not row["chunk_sha1"]}
+        for batch in _batches(list(legacy)):
+            response = supabase_client.table("vectors").select("id, content").in_("id", batch).execute()
+            for row in response.data:
+                legacy[row["id"]]["chunk_sha1"] = compute_sha1_from_content(row["content"].encode("utf-8"))
+    chunk_ids = defaultdict(list)
+    for row in rows:
+        chunk_ids[row["chunk_sha1"]].append(str(row["id"]))
+    return chunk_ids
+
+def update_vectors_metadata(chunks: List[Tuple[str, str]], metadata):
+    '''Set the metadata of the (id, chunk_sha1) stored chunks.'''
+    if shared_storage:
+        for batch in _batches([document_id for document_id, _ in chunks]):
+            supabase_client.table(vectors_table).update({"metadata": metadata}).in_("id", batch).execute()
+        return
+    # Each vector keeps its own chunk_sha1, the rows are upserted on their id, which only updates their metadata
+    for start in range(0, len(chunks), ids_batch_size):
+        supabase_client.table(vectors_table).upsert([
+            {"id": int(document_id), "metadata": {**metadata, "chunk_sha1": chunk_sha1}}
+            for document_id, chunk_sha1 in chunks[start:start + ids_batch_size]
+        ]).execute()
+
+def delete_vectors(ids: List[str]):
+    '''Delete vectors in bulk, their summaries first because of the foreign key.'''
+    for batch in _batches(ids):
+        supabase_client.table("summaries").delete().in_("document_id", batch).execute()
+        supabase_client.table(vectors_table).delete().in_("id", batch).execute()
+    if ids:
+        delete_orphan_chunks()
+
+def delete_orphan_chunks():
+    '''With shared storage, drop the chunks no user references anymore.'''
+    if shared_storage:
+        supabase_client.rpc("delete_orphan_chunks", {}).execute()
+
+async def adelete_orphan_chunks():
+    if shared_storage:
+        await rpc("delete_orphan_chunks", {})
+
+def _batches(ids: List[str]) -> Iterator[List[str]]:
+    for start in range(0, len(ids), ids_batch_size):
+        yield ids[start:start + ids_batch_size]
+
+async def create_user(user_id, date):
     logger.info(f"New user entry in db document for user {user_id}")
-    supabase_client.table("users").insert(
-        {"user_id": user_id, "date": date, "requests_count": 1}).execute()
+    await execute(get_database().table("users").insert(
+        {"user_id": user_id, "date": date, "requests_count": 1}))
 
-def update_user_request_count(user_id, date, requests_count):
+async def update_user_request_count(user_id, date, requests_count):
     logger.info(f"User {user_id} request count updated to {requests_count}")
-    supabase_client.table("users").update(
-        { "requests_count": requests_count}).match({"user_id": user_id, "date": date}).execute()
+    await execute(get_database().table("users").update(
+        { "requests_count": requests_count}).match({"user_id": user_id, "date": date}))
 
 
 def create_embedding(content):
     return embeddings.embed_query(content)
 
 
+def embed_question(question):
+    '''Embedding of a chat question, served from the in-process cache shared by both retrieval paths.'''
+    return query_embedding_cache.embed(embeddings, question)
+
 
-def similarity_search(query, table='match_summaries', top_k=5, threshold=0.5):
-    query_embedding = create_embedding(query)
-    summaries = supabase_client.rpc(
+async def similarity_search(query, table='match_summaries', top_k=5, threshold=0.5):
+    query_embedding = await asyncio.to_thread(embed_question, query)
+    summaries = await rpc(
         table, {'query_embedding': query_embedding,
-                'match_count': top_k, 'match_threshold': threshold}
-    ).execute()
+                'match_count': top_k, 'match_threshold': threshold})
     return summaries.data
 
 
@@ -0,0 +1,89 @@
+-- Shared chunk storage, used when the backend runs with VECTOR_STORAGE_MODE=shared
+-- The content and embedding of a chunk are stored once, whatever the number of users who uploaded it,
+-- and every user holds a lightweight reference to it with the metadata of their own file.
+create extension if not exists vector;
+
+-- Content addressed chunks, sha1 is the hex sha1 of the utf-8 content
+create table if not exists chunks (
+sha1 text primary key,
+content text, -- corresponds to Document.pageContent
+embedding vector(1536), -- 1536 works for OpenAI embeddings, change if needed
+created_at timestamptz default now()
+);
+
+-- References of the users to the chunks, they replace the rows of the vectors table
+create table if not exists user_chunks (
+id bigserial primary key,
+user_id text,
+chunk_sha1 text references chunks(sha1),
+metadata jsonb -- corresponds to Document.metadata
+);
+
+create index if not exists user_chunks_user_id_idx on user_chunks (user_id);
+create index if not exists user_chunks_chunk_sha1_idx on user_chunks (chunk_sha1);
+
+-- Rows of the users with the content of their chunks, for reads that need the content
+create or replace view user_chunks_with_content as
+SELECT
+    user_chunks.id,
+    user_chunks.user_id,
+    chunks.content,
+    user_chunks.metadata
+FROM
+    user_chunks
+    JOIN chunks ON chunks.sha1 = user_chunks.chunk_sha1;
+
+CREATE OR REPLACE FUNCTION match_vectors(query_embedding vector(1536), match_count int, p_user_id text)
+    RETURNS TABLE(
+        id bigint,
+        user_id text,
+        content text,
+        metadata jsonb,
+        -- we return matched vectors to enable maximal marginal relevance searches
+        embedding vector(1536),
+        similarity float)
+    LANGUAGE plpgsql
+    AS $$
+    # variable_conflict use_column
+BEGIN
+    RETURN query
+    SELECT
+        user_chunks.id,
+        user_chunks.user_id,
+        chunks.content,
+        user_chunks.metadata,
+        chunks.embedding,
+        1 -(chunks.embedding <=> query_embedding) AS similarity
+    FROM
+        user_chunks
+        JOIN chunks ON chunks.sha1 = user_chunks.chunk_sha1
+    WHERE user_chunks.user_id = p_user_id
+    ORDER BY
+        chunks.embedding <=> query_embedding
+    LIMIT match_count;
+END;
+$$;
+
+-- Delete the chunks no user references anymore. Recent chunks are kept, their references may be being inserted.
+CREATE OR REPLACE FUNCTION delete_orphan_chunks()
+    RETURNS void
+    LANGUAGE sql
+    AS $$
+    DELETE FROM chunks
+    WHERE created_at < now() - interval '1 hour'
+    AND NOT EXISTS (SELECT 1 FROM user_chunks WHERE user_chunks.chunk_sha1 = chunks.sha1);
+$$;
+
+-- Optional, move the rows of the vectors table to the shared storage
+-- create extension if not exists pgcrypto;
+-- insert into chunks (sha1, content, embedding)
+--     select distinct on (encode(digest(content, 'sha1'), 'hex')) encode(digest(content, 'sha1'), 'hex'), content, embedding
+--     from vectors
+-- on conflict do nothing;
+-- insert into user_chunks (id, user_id, chunk_sha1, metadata)
+--     select id, user_id, encode(digest(content, 'sha1'), 'hex'), metadata from vectors;
+-- select setval('user_chunks_id_seq', (select max(id) from user_chunks));
+
+-- Summaries now point to the references of the users, existing summaries need the rows moved above
+alter table summaries drop constraint if exists summaries_document_id_fkey;
+alter table summaries add constraint summaries_document_id_fkey foreign key (document_id) references user_chunks(id);